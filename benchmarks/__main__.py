@@ -0,0 +1,85 @@
+import json
+import tempfile
+from pathlib import Path
+
+import click
+
+from benchmarks.suite import bench_render, bench_search, bench_tactics, run_isolated
+
+
+def report(name: str, result: dict):
+    click.echo(name)
+    for key, value in result.items():
+        click.echo(f"  {key:<24}{value}")
+
+
+@click.command()
+@click.argument(
+    "benchmarks",
+    nargs=-1,
+    type=click.Choice(["search", "tactics", "render"]),
+)
+@click.option("--width", type=int, default=3, help="Moves per explorer position")
+@click.option("--depth", type=int, default=4, help="Plies of the explorer tree")
+@click.option("--engines", type=int, default=1)
+@click.option("--engine-delay", type=float, default=0.01, help="Seconds per search")
+@click.option("--latency", type=float, default=0.01, help="Seconds per request")
+@click.option("--rate-limit-every", type=int, help="Answer every n-th request 429")
+@click.option("--max-requests", type=int, default=4, help="Requests in flight")
+@click.option("--tactics", type=int, default=10000, help="Tactics to store and list")
+@click.option("--puzzles", type=int, default=2000, help="Puzzles to render")
+@click.option("--processes", type=int, help="Render processes, defaults to all")
+@click.option("--directory", type=click.Path(path_type=Path), help="Keeps test data")
+@click.option("--json", "json_path", type=click.Path(path_type=Path))
+def main(
+    benchmarks: tuple[str, ...],
+    width: int,
+    depth: int,
+    engines: int,
+    engine_delay: float,
+    latency: float,
+    rate_limit_every: int | None,
+    max_requests: int,
+    tactics: int,
+    puzzles: int,
+    processes: int | None,
+    directory: Path | None,
+    json_path: Path | None,
+):
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = directory or Path(tmp)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        results = {}
+        if not benchmarks or "search" in benchmarks:
+            results["search"] = run_isolated(
+                bench_search,
+                directory=directory,
+                width=width,
+                depth=depth,
+                engines=engines,
+                engine_delay=engine_delay,
+                latency=latency,
+                rate_limit_every=rate_limit_every,
+                max_requests=max_requests,
+            )
+            report("search", results["search"])
+
+        if not benchmarks or "tactics" in benchmarks:
+            results["tactics"] = run_isolated(
+                bench_tactics, directory=directory, count=tactics
+            )
+            report("tactics", results["tactics"])
+
+        if not benchmarks or "render" in benchmarks:
+            results["render"] = run_isolated(
+                bench_render, directory=directory, count=puzzles, processes=processes
+            )
+            report("render", results["render"])
+
+    if json_path is not None:
+        json_path.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from chess import Board, Move
+
+
+def synthetic_moves(board: Board, width: int) -> list[dict]:
+    # the same position always gets the same moves and game counts
+    def rank(move: Move) -> bytes:
+        return hashlib.md5((board.fen() + move.uci()).encode()).digest()
+
+    moves = sorted(board.legal_moves, key=rank)[:width]
+    return [
+        {"uci": move.uci(), "white": 400 // (i + 1), "draws": 100, "black": 50 * i}
+        for i, move in enumerate(moves)
+    ]
+
+
+class ExplorerHandler(BaseHTTPRequestHandler):
+    server: "ExplorerStandIn"
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        board = Board(query["fen"][0])
+
+        with self.server.lock:
+            self.server.requests += 1
+            every = self.server.rate_limit_every
+            limited = self.server.requests <= self.server.rate_limit_first or bool(
+                every and self.server.requests % every == 0
+            )
+            if limited:
+                self.server.rate_limited += 1
+
+        time.sleep(self.server.latency)
+
+        if limited:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+
+        moves = []
+        if board.ply() < self.server.depth:
+            moves = synthetic_moves(board, self.server.width)
+        body = json.dumps({"moves": moves}).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# A local opening explorer serving a synthetic tree of the given width and
+# depth. The first rate_limit_first requests and every rate_limit_every-th
+# request are answered with a 429.
+class ExplorerStandIn(ThreadingHTTPServer):
+    def __init__(
+        self,
+        width: int = 3,
+        depth: int = 4,
+        latency: float = 0.0,
+        rate_limit_every: int | None = None,
+        rate_limit_first: int = 0,
+    ):
+        super().__init__(("127.0.0.1", 0), ExplorerHandler)
+        self.width = width
+        self.depth = depth
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.rate_limit_first = rate_limit_first
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.thread: threading.Thread | None = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/lichess"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
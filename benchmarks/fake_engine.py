@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# A scripted UCI engine for benchmarks. Scores are derived from a hash of
+# the position, so every run analyses the same lines. The time per search
+# is simulated:
+#
+#   FAKE_ENGINE_DELAY  seconds per depth limited search, default 0.01
+#   FAKE_ENGINE_NPS    nodes per second for node limited searches
+#   FAKE_ENGINE_STATS  file to append "<busy seconds> <searches>" to on quit
+import hashlib
+import os
+import sys
+import time
+
+import chess
+
+VALUES = {
+    chess.PAWN: 100,
+    chess.KNIGHT: 300,
+    chess.BISHOP: 300,
+    chess.ROOK: 500,
+    chess.QUEEN: 900,
+    chess.KING: 0,
+}
+
+DELAY = float(os.environ.get("FAKE_ENGINE_DELAY", "0.01"))
+NPS = float(os.environ.get("FAKE_ENGINE_NPS", "1000000"))
+STATS = os.environ.get("FAKE_ENGINE_STATS")
+
+
+def score(board: chess.Board, move: chess.Move) -> tuple[bool, int]:
+    if board.gives_check(move):
+        board.push(move)
+        mate = board.is_checkmate()
+        board.pop()
+        if mate:
+            return True, 1
+
+    captured = board.piece_at(move.to_square)
+    value = VALUES[captured.piece_type] if captured is not None else 0
+    digest = hashlib.md5((board.fen() + move.uci()).encode()).digest()
+    return False, value + digest[0] % 40 - 20
+
+
+def search_time(args: list[str]) -> float:
+    options = dict(zip(args[::2], args[1::2]))
+    if "movetime" in options:
+        return int(options["movetime"]) / 1000
+    if "nodes" in options:
+        return int(options["nodes"]) / NPS
+    return DELAY
+
+
+def go(board: chess.Board, multipv: int, args: list[str]):
+    time.sleep(search_time(args))
+
+    scored = [(move, *score(board, move)) for move in board.legal_moves]
+    scored.sort(key=lambda item: (not item[1], -item[2], item[0].uci()))
+
+    depth = int(dict(zip(args[::2], args[1::2])).get("depth", 20))
+    for index, (move, is_mate, value) in enumerate(scored[:multipv], start=1):
+        kind = "mate" if is_mate else "cp"
+        print(
+            f"info depth {depth} seldepth {depth} multipv {index} "
+            f"score {kind} {value} nodes 1000 pv {move.uci()}"
+        )
+
+    print(f"bestmove {scored[0][0].uci() if scored else '(none)'}")
+
+
+def main():
+    board = chess.Board()
+    multipv = 1
+    busy = 0.0
+    searches = 0
+
+    for line in sys.stdin:
+        command, *args = line.split() or [""]
+
+        if command == "uci":
+            print("id name FakeEngine 1")
+            print("option name MultiPV type spin default 1 min 1 max 500")
+            print("option name Threads type spin default 1 min 1 max 512")
+            print("option name Hash type spin default 16 min 1 max 33554432")
+            print("uciok")
+        elif command == "isready":
+            print("readyok")
+        elif command == "setoption" and args[1] == "MultiPV":
+            multipv = int(args[-1])
+        elif command == "position":
+            moves = args.index("moves") if "moves" in args else len(args)
+            if args[0] == "startpos":
+                board = chess.Board()
+            else:
+                board = chess.Board(" ".join(args[1:moves]))
+            for uci in args[moves + 1 :]:
+                board.push_uci(uci)
+        elif command == "go":
+            start = time.monotonic()
+            go(board, multipv, args)
+            busy += time.monotonic() - start
+            searches += 1
+        elif command == "quit":
+            break
+
+        sys.stdout.flush()
+
+    if STATS:
+        with open(STATS, "a") as f:
+            f.write(f"{busy} {searches}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import io
+import multiprocessing
+import os
+import random
+import resource
+import stat
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Callable
+
+import chess
+from chess import Board
+from chess.engine import Cp, PovScore
+
+from benchmarks.explorer import ExplorerStandIn
+from optac.output import DiagramRenderer, render_html
+from optac.params import EngineParams, LichessParams, OptacParams, SearchParams
+from optac.position_store import PositionStore
+from optac.search import run_search
+from optac.tactic import Tactic
+from optac.tactic_store import TacticStore
+
+FAKE_ENGINE = Path(__file__).parent / "fake_engine.py"
+
+
+def peak_memory_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def measured(benchmark: Callable[..., dict], kwargs: dict) -> dict:
+    result = benchmark(**kwargs)
+    result["peak_memory_mb"] = round(peak_memory_mb(), 1)
+    return result
+
+
+def run_isolated(benchmark: Callable[..., dict], **kwargs) -> dict:
+    # a fresh process per benchmark, so peak memory is its own, not counting
+    # engines or render workers
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as pool:
+        return pool.submit(measured, benchmark, kwargs).result()
+
+
+def remove_database(path: Path):
+    for suffix in ("", "-wal", "-shm"):
+        path.with_name(path.name + suffix).unlink(missing_ok=True)
+
+
+def engine_command(directory: Path) -> Path:
+    # the engine is started without arguments, run it with this interpreter
+    path = directory / "fake-engine"
+    path.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_ENGINE}" "$@"\n')
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return path
+
+
+def bench_search(
+    directory: Path,
+    width: int = 3,
+    depth: int = 4,
+    engines: int = 1,
+    engine_delay: float = 0.01,
+    latency: float = 0.01,
+    rate_limit_every: int | None = None,
+    max_requests: int = 4,
+) -> dict:
+    stats = directory / "engine-stats"
+    stats.unlink(missing_ok=True)
+    os.environ["FAKE_ENGINE_DELAY"] = str(engine_delay)
+    os.environ["FAKE_ENGINE_STATS"] = str(stats)
+
+    with ExplorerStandIn(width, depth, latency, rate_limit_every) as explorer:
+        params = OptacParams(
+            chess.STARTING_FEN,
+            EngineParams(engine_command(directory), depth=10, processes=engines),
+            SearchParams(top_n=width, max_depth=depth),
+            LichessParams(
+                url=explorer.url,
+                cache=None,
+                max_requests=max_requests,
+                requests_per_second=1000,
+            ),
+        )
+        # cached analyses would skip the engine
+        remove_database(directory / "positions.sqlite")
+        remove_database(directory / "search-puzzles.sqlite")
+        position_store = PositionStore(directory / "positions.sqlite")
+        tactic_store = TacticStore(directory / "search-puzzles.sqlite")
+
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            run_search(params, position_store, tactic_store, resume=False)
+        elapsed = time.perf_counter() - start
+
+    with position_store:
+        positions = len(position_store.visited())
+    store = position_store.stats()
+    store_ops = store["hits"] + store["misses"] + store["writes"]
+
+    busy = searches = 0.0
+    for line in stats.read_text().splitlines():
+        seconds, count = line.split()
+        busy += float(seconds)
+        searches += int(count)
+
+    return {
+        "positions": positions,
+        "seconds": round(elapsed, 3),
+        "positions_per_second": round(positions / elapsed, 1),
+        "engine_searches": int(searches),
+        "engine_utilization": round(busy / (elapsed * engines), 3),
+        "store_ops_per_second": round(store_ops / elapsed, 1),
+        "explorer_requests": explorer.requests,
+        "rate_limited": explorer.rate_limited,
+    }
+
+
+def synthetic_tactics(count: int, seed: int = 0):
+    # random playouts with random solutions, only the shape of the data matters
+    rng = random.Random(seed)
+    made = 0
+    while made < count:
+        board = Board()
+        for _ in range(rng.randint(4, 30)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+
+        replay = board.copy()
+        solution = []
+        for _ in range(3):
+            moves = list(replay.legal_moves)
+            if not moves:
+                break
+            solution.append(rng.choice(moves))
+            replay.push(solution[-1])
+
+        if len(solution) < 2 or not board.move_stack:
+            continue
+
+        score = PovScore(Cp(rng.randint(-500, 500)), board.turn)
+        yield Tactic(position=board, score=score, solution=solution)
+        made += 1
+
+
+def tactic_store_path(directory: Path, count: int) -> Path:
+    path = directory / f"puzzles-{count}.sqlite"
+    if not path.exists():
+        with TacticStore(path) as store:
+            store.store_many(synthetic_tactics(count))
+    return path
+
+
+def bench_tactics(directory: Path, count: int = 10000) -> dict:
+    tactics = list(synthetic_tactics(count))
+    path = directory / "bench-puzzles.sqlite"
+    remove_database(path)
+
+    with TacticStore(path) as store:
+        start = time.perf_counter()
+        store.store_many(tactics)
+        stored = time.perf_counter() - start
+
+        start = time.perf_counter()
+        records = store.list()
+        listed = time.perf_counter() - start
+
+    return {
+        "tactics": len(records),
+        "store_per_second": round(len(tactics) / stored, 1),
+        "list_seconds": round(listed, 3),
+        "list_per_second": round(len(records) / listed, 1),
+    }
+
+
+def bench_render(directory: Path, count: int = 2000, processes: int | None = None):
+    path = tactic_store_path(directory, count)
+
+    with TacticStore(path) as store, DiagramRenderer(processes=processes) as renderer:
+        start = time.perf_counter()
+        html = render_html(store.iter_tactics(ordered=True), renderer=renderer)
+        elapsed = time.perf_counter() - start
+
+    return {
+        "puzzles": html.count('class="puzzle"'),
+        "seconds": round(elapsed, 3),
+        "puzzles_per_second": round(count / elapsed, 1),
+        "html_mb": round(len(html) / 1024**2, 1),
+    }
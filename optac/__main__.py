@@ -2,12 +2,33 @@ from pathlib import Path
 
 import click
 
-from optac.position_store import PositionStore
-from optac.tactic_store import TacticStore
-from optac.params import OptacParams
-from optac.output import render_html
+from optac.position_store import PositionStore, is_shelve, migrate_shelve
+from optac.tactic_store import TacticStore, migrate_directory
+from optac.params import LichessParams, OptacParams
+from optac.explorer_cache import default_cache_path
+from optac.openings import build_index
+from optac.output import DiagramCache, DiagramRenderer, render_pages, write_html
 from optac.search import run_search
 
+# the shelve positions were kept in before SQLite
+LEGACY_POSITIONS = Path("positions.db")
+
+
+def check_legacy_positions(positions: Path):
+    # a search must not silently start over next to the positions of an
+    # older version
+    shelf = None
+    if is_shelve(positions):
+        shelf = positions
+    elif not positions.exists() and is_shelve(LEGACY_POSITIONS):
+        shelf = LEGACY_POSITIONS
+
+    if shelf is not None:
+        raise click.ClickException(
+            f"{shelf} holds positions of an older version, convert them with "
+            f"'optac migrate-positions {shelf} -c {positions}'"
+        )
+
 
 @click.group()
 def cli():
@@ -20,26 +41,163 @@ def cli():
     "--positions",
     "-c",
     type=click.Path(path_type=Path),
-    default="positions.db",
+    default="positions.sqlite",
 )
 @click.option("--puzzles", "-p", type=click.Path(path_type=Path), required=True)
-def search(params, positions, puzzles):
+@click.option("--cache-size", type=int, default=10000, help="Positions kept in memory")
+@click.option("--restart", is_flag=True, help="Ignore an interrupted search")
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only report positions not expanded with the same parameters before",
+)
+@click.option("--verbose", "-v", is_flag=True, help="Report every position")
+@click.option(
+    "--metrics",
+    type=click.Path(path_type=Path),
+    help="Write metrics in the Prometheus textfile format",
+)
+@click.option("--metrics-interval", type=float, default=15.0, help="Seconds")
+@click.option(
+    "--trace",
+    type=click.Path(path_type=Path),
+    help="Write a trace of every position in the Chrome trace-event format",
+)
+def search(
+    params,
+    positions,
+    puzzles,
+    cache_size,
+    restart,
+    incremental,
+    verbose,
+    metrics,
+    metrics_interval,
+    trace,
+):
+    check_legacy_positions(positions)
     run_search(
         params=OptacParams.from_file(params),
-        position_store=PositionStore(positions),
+        position_store=PositionStore(positions, cache_size=cache_size),
         tactic_store=TacticStore(puzzles),
+        resume=not restart,
+        incremental=incremental,
+        verbose=verbose,
+        metrics_file=metrics,
+        metrics_interval=metrics_interval,
+        trace_file=trace,
     )
 
 
+@cli.command()
+@click.argument("shelf", type=click.Path(path_type=Path))
+@click.option(
+    "--positions",
+    "-c",
+    type=click.Path(path_type=Path),
+    default="positions.sqlite",
+)
+def migrate_positions(shelf: Path, positions: Path):
+    with PositionStore(positions) as store:
+        count = migrate_shelve(shelf, store)
+    click.echo(f"Migrated {count} positions to {positions}")
+
+
 @cli.command()
 @click.argument("path", type=click.Path(path_type=Path))
 @click.option("--puzzles", "-p", type=click.Path(path_type=Path), required=True)
-def render(path: Path, puzzles: Path):
-    tactic_store = TacticStore(puzzles)
-    tactics = tactic_store.list()
+@click.option("--page-size", type=int, help="Split the book into pages")
+@click.option("--processes", type=int, default=None, help="Defaults to all cores")
+@click.option(
+    "--diagrams",
+    type=click.Path(path_type=Path),
+    default=lambda: default_cache_path("diagrams.sqlite3"),
+    help="Cache of rendered diagrams",
+)
+@click.option("--no-cache", is_flag=True, help="Render all diagrams again")
+def render(
+    path: Path,
+    puzzles: Path,
+    page_size: int | None,
+    processes: int | None,
+    diagrams: Path,
+    no_cache: bool,
+):
+    cache = DiagramCache(diagrams) if not no_cache else None
+    renderer = DiagramRenderer(cache, processes=processes)
+
+    with TacticStore(puzzles) as tactic_store, renderer:
+        tactics = tactic_store.iter_tactics(ordered=True)
+        if page_size is not None:
+            paths = render_pages(tactics, path, page_size, renderer=renderer)
+            click.echo(f"Rendered {len(paths)} pages")
+        else:
+            write_html(tactics, path, renderer=renderer)
+
+    if cache is not None:
+        cache.close()
+
+
+@cli.command()
+@click.option("--puzzles", "-p", type=click.Path(path_type=Path), required=True)
+@click.option("--processes", type=int, default=None, help="Defaults to all cores")
+@click.option("--remove", is_flag=True, help="Delete tactics that are not valid")
+def revalidate(puzzles: Path, processes: int | None, remove: bool):
+    with TacticStore(puzzles) as tactic_store:
+        invalid = tactic_store.revalidate(processes)
+        if remove:
+            tactic_store.delete(invalid)
+    click.echo(f"{len(invalid)} tactics are not valid")
 
-    html = render_html(tactics)
-    path.write_text(html)
+
+@cli.command()
+@click.argument("directory", type=click.Path(exists=True, path_type=Path))
+@click.option("--puzzles", "-p", type=click.Path(path_type=Path), required=True)
+def migrate_puzzles(directory: Path, puzzles: Path):
+    with TacticStore(puzzles) as tactic_store:
+        count = migrate_directory(directory, tactic_store)
+    click.echo(f"Migrated {count} tactics to {puzzles}")
+
+
+@cli.command("build-index")
+@click.argument(
+    "pgns", nargs=-1, required=True, type=click.Path(exists=True, path_type=Path)
+)
+@click.option("--output", "-o", type=click.Path(path_type=Path), required=True)
+@click.option("--speeds", default=LichessParams.speeds, show_default=True)
+@click.option("--ratings", default=LichessParams.ratings, show_default=True)
+@click.option("--max-ply", type=int, default=30, help="Moves counted per game")
+@click.option("--min-games", type=int, default=1, help="Drop rarer moves")
+@click.option("--processes", type=int, default=None, help="Defaults to all cores")
+@click.option(
+    "--run-size",
+    type=int,
+    default=2_000_000,
+    show_default=True,
+    help="Moves counted in memory before they are written to a temporary file",
+)
+def build_index_command(
+    pgns: tuple[Path, ...],
+    output: Path,
+    speeds: str,
+    ratings: str,
+    max_ply: int,
+    min_games: int,
+    processes: int | None,
+    run_size: int,
+):
+    # PGN dumps, plain or compressed with .bz2, .gz or .zst
+    games, moves = build_index(
+        list(pgns),
+        output,
+        speeds=speeds,
+        ratings=ratings,
+        max_ply=max_ply,
+        min_games=min_games,
+        processes=processes,
+        run_size=run_size,
+    )
+    click.echo(f"Indexed {moves} moves of {games} games to {output}")
 
 
 if __name__ == "__main__":
@@ -1,4 +1,13 @@
 from .analysis import Analysis, ScoredPV
-from .engine import Engine
+from .cache import AnalysisStore, CachedEngine
+from .engine import Analyser, Engine, EnginePool
 
-__all__ = ["Analysis", "Engine", "ScoredPV"]
+__all__ = [
+    "Analyser",
+    "Analysis",
+    "AnalysisStore",
+    "CachedEngine",
+    "Engine",
+    "EnginePool",
+    "ScoredPV",
+]
@@ -0,0 +1,83 @@
+from typing import Protocol
+
+from chess import Board
+
+from optac.metrics import metrics
+
+from .analysis import Analysis
+from .engine import Engine
+
+
+class AnalysisStore(Protocol):
+    def get_analysis(
+        self,
+        board: Board,
+        engine: str,
+        options: str,
+        depth: int,
+        multipv: int,
+    ) -> Analysis | None: ...
+
+    def put_analysis(
+        self,
+        board: Board,
+        engine: str,
+        options: str,
+        multipv: int,
+        analysis: Analysis,
+    ): ...
+
+
+# Analyses are cached per engine version, options and limit. A deeper
+# analysis, or one with more PVs, satisfies a request for a shallower one.
+class CachedEngine:
+    def __init__(self, engine: Engine, store: AnalysisStore, game: object = None):
+        self.engine = engine
+        self.store = store
+        # analyses of the same game keep the engine hash
+        self.game = game
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def name(self):
+        return self.engine.name
+
+    @property
+    def depth(self):
+        return self.engine.depth
+
+    def cached(self, board: Board, depth: int | None = None) -> Analysis | None:
+        options, depth = self.engine.cache_key(depth)
+        return self.store.get_analysis(
+            board,
+            engine=self.engine.identity,
+            options=options,
+            depth=depth,
+            multipv=self.engine.multipv,
+        )
+
+    async def analyse(self, board: Board, depth: int | None = None) -> Analysis | None:
+        if board.is_game_over():
+            return None
+
+        analysis = self.cached(board, depth)
+        if analysis is not None:
+            self.hits += 1
+            metrics.inc("analysis_cache_hits_total")
+            return analysis
+
+        self.misses += 1
+        metrics.inc("analysis_cache_misses_total")
+        analysis = await self.engine.analyse(board, depth, game=self.game)
+        if analysis is not None:
+            options, _ = self.engine.cache_key(depth)
+            self.store.put_analysis(
+                board,
+                engine=self.engine.identity,
+                options=options,
+                multipv=self.engine.multipv,
+                analysis=analysis,
+            )
+
+        return analysis
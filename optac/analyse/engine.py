@@ -1,22 +1,50 @@
-from contextlib import AbstractAsyncContextManager
+import asyncio
+import hashlib
+import json
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
 from pathlib import Path
+from typing import AsyncIterator, Protocol
 
 from chess import Board
-from chess.engine import Limit, popen_uci, ConfigMapping
+from chess.engine import EngineTerminatedError, Limit, popen_uci, ConfigMapping
+
+from optac import trace
+from optac.metrics import metrics
 
 from .analysis import Analysis
 
+# seconds an engine gets to quit before its transport is closed
+QUIT_TIMEOUT = 2.0
+
+
+class Analyser(Protocol):
+    async def analyse(self, board: Board) -> Analysis | None: ...
+
+
+def digest(*values) -> str:
+    data = json.dumps(values, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()[:16]
+
 
 class Engine(AbstractAsyncContextManager):
     def __init__(
         self,
         exec: Path | str,
-        depth: int,
+        depth: int | None = None,
         options: ConfigMapping | None = None,
+        multipv: int = 2,
+        nodes: int | None = None,
+        movetime: float | None = None,
     ):
+        if depth is None and nodes is None and movetime is None:
+            raise ValueError("Engine needs a depth, nodes or movetime limit")
+
         self.exec = Path(exec)
         self.name = self.exec.name
         self.depth = depth
+        self.nodes = nodes
+        self.movetime = movetime
+        self.multipv = multipv
 
         if options is None:
             options = {}
@@ -34,30 +62,89 @@ class Engine(AbstractAsyncContextManager):
                 raise ValueError(f"Tried setting managed option: {key}")
             await self.engine.configure({key: value})
 
+    @property
+    def identity(self) -> str:
+        # name and version as reported by the engine
+        if self.engine is None:
+            raise ValueError("Engine not spawned")
+        return self.engine.id.get("name", self.name)
+
+    @property
+    def options_id(self) -> str:
+        return digest(sorted(self.options.items()))
+
+    @property
+    def depth_limited(self) -> bool:
+        return self.nodes is None and self.movetime is None
+
+    def limit(self, depth: int | None = None) -> Limit:
+        # an explicit depth replaces the configured limit
+        if depth is not None:
+            return Limit(depth=depth)
+        return Limit(depth=self.depth, nodes=self.nodes, time=self.movetime)
+
+    def cache_key(self, depth: int | None = None) -> tuple[str, int]:
+        # Depth limited analyses are shared between depths, a deeper one
+        # satisfies a shallower request. Node and time limits stop at varying
+        # depths, so those analyses only match the same limit.
+        if depth is None and self.depth_limited:
+            # the constructor requires a limit, without nodes or movetime
+            # it is the depth
+            assert self.depth is not None
+            depth = self.depth
+        if depth is not None:
+            return self.options_id, depth
+        limit = [self.depth, self.nodes, self.movetime]
+        return digest(sorted(self.options.items()), limit), 0
+
     async def close(self):
+        # Quit before closing the transport. An engine that already exited,
+        # like one interrupted with the search by SIGINT, never answers quit.
+        if self.engine is not None:
+            engine, self.engine = self.engine, None
+            if self.transport is not None and self.transport.get_returncode() is None:
+                try:
+                    await asyncio.wait_for(engine.quit(), QUIT_TIMEOUT)
+                except (EngineTerminatedError, TimeoutError, asyncio.InvalidStateError):
+                    pass
+
         if self.transport is not None:
             self.transport.close()
             self.transport = None
 
-        if self.engine is not None:
-            await self.engine.quit()
-            self.engine = None
-
-    async def analyse(self, board: Board) -> Analysis | None:
+    async def analyse(
+        self,
+        board: Board,
+        depth: int | None = None,
+        game: object = None,
+    ) -> Analysis | None:
         if self.engine is None:
             raise ValueError("Engine not spawned")
 
         if board.is_game_over():
             return None
 
-        result = await self.engine.analyse(
-            board,
-            limit=Limit(depth=self.depth),
-            multipv=2,
-        )
+        # python-chess sends ucinewgame, clearing the hash, when the game changes
+        limit = self.limit(depth)
+        # the FEN labels the span, it is only built for a trace
+        labels = {"board": board.fen()} if trace.active() else {}
+        with metrics.timer("engine_analyse_seconds", **labels) as span:
+            result = await self.engine.analyse(
+                board,
+                limit=limit,
+                multipv=self.multipv,
+                game=game,
+            )
+
+            # node and time limits keep the depth the engine reached
+            depth = limit.depth or 0
+            if limit.nodes is not None or limit.time is not None:
+                depth = result[0].get("depth", 0) if result else 0
+            span["depth"] = depth
+
         return Analysis.from_engine(
             engine_name=self.name,
-            depth=self.depth,
+            depth=depth,
             result=result,
         )
 
@@ -67,3 +154,90 @@ class Engine(AbstractAsyncContextManager):
 
     async def __aexit__(self, *args, **kwargs):
         await self.close()
+
+
+def partition_resources(
+    options: ConfigMapping | None,
+    size: int,
+    threads: int | None = None,
+    hash: int | None = None,
+) -> dict:
+    # split total thread and hash (MB) budgets evenly between the engines
+    options = dict(options or {})
+    for name, total in (("Threads", threads), ("Hash", hash)):
+        if total is None:
+            continue
+        if name in options:
+            raise ValueError(f"{name} is set both as option and as total budget")
+        if total < size:
+            raise ValueError(f"{name} budget of {total} is less than one per engine")
+        options[name] = total // size
+    return options
+
+
+class EnginePool(AbstractAsyncContextManager):
+    def __init__(
+        self,
+        exec: Path | str,
+        depth: int | None = None,
+        options: ConfigMapping | None = None,
+        size: int = 1,
+        nodes: int | None = None,
+        movetime: float | None = None,
+        threads: int | None = None,
+        hash: int | None = None,
+    ):
+        if size < 1:
+            raise ValueError("EnginePool needs at least one engine")
+
+        options = partition_resources(options, size, threads=threads, hash=hash)
+        self.engines = [
+            Engine(exec, depth=depth, options=options, nodes=nodes, movetime=movetime)
+            for _ in range(size)
+        ]
+        self.idle: asyncio.Queue[Engine] = asyncio.Queue()
+
+    @property
+    def name(self):
+        return self.engines[0].name
+
+    @property
+    def depth(self):
+        return self.engines[0].depth
+
+    @property
+    def size(self):
+        return len(self.engines)
+
+    async def spawn(self):
+        try:
+            await asyncio.gather(*(engine.spawn() for engine in self.engines))
+        except BaseException:
+            await self.close()
+            raise
+
+        for engine in self.engines:
+            self.idle.put_nowait(engine)
+
+    async def close(self):
+        self.idle = asyncio.Queue()
+        await asyncio.gather(*(engine.close() for engine in self.engines))
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Engine]:
+        engine = await self.idle.get()
+        try:
+            yield engine
+        finally:
+            self.idle.put_nowait(engine)
+
+    async def analyse(self, board: Board) -> Analysis | None:
+        async with self.acquire() as engine:
+            return await engine.analyse(board)
+
+    async def __aenter__(self):
+        await self.spawn()
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        await self.close()
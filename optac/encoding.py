@@ -0,0 +1,202 @@
+import struct
+
+import chess
+from chess import Board, Move
+from chess.engine import Cp, Mate, PovScore
+
+from optac.analyse import Analysis, ScoredPV
+from optac.lichess import MoveStats
+from optac.tactic import Tactic, TacticMetadata
+from optac.util import pack_move, unpack_move
+
+# Bump when the layout changes, decoders reject unknown versions. Version 2
+# added the metadata of tactics, version 1 data is still read.
+VERSION = 2
+VERSIONS = (1, 2)
+
+U16 = struct.Struct("<H")
+
+
+class Writer:
+    def __init__(self):
+        self.buffer = bytearray([VERSION])
+
+    def varint(self, value: int):
+        if value < 0:
+            raise ValueError(f"Negative varint: {value}")
+        while value >= 0x80:
+            self.buffer.append(value & 0x7F | 0x80)
+            value >>= 7
+        self.buffer.append(value)
+
+    def signed(self, value: int):
+        # zigzag, so small negative numbers stay small
+        self.varint(value << 1 if value >= 0 else (-value << 1) - 1)
+
+    def string(self, value: str):
+        data = value.encode()
+        self.varint(len(data))
+        self.buffer += data
+
+    def move(self, move: Move):
+        self.buffer += U16.pack(pack_move(move))
+
+    def moves(self, moves: list[Move]):
+        self.varint(len(moves))
+        for move in moves:
+            self.move(move)
+
+    def score(self, score: PovScore):
+        # stored from white's point of view, like score_to_dict
+        white = score.white()
+        mate = white.mate()
+        if mate is not None:
+            self.signed(mate << 1 | 1)
+        else:
+            cp = white.score()
+            assert cp is not None
+            self.signed(cp << 1)
+
+    def getvalue(self) -> bytes:
+        return bytes(self.buffer)
+
+
+class Reader:
+    def __init__(self, data: bytes):
+        if not data or data[0] not in VERSIONS:
+            version = data[0] if data else None
+            raise ValueError(f"Unsupported encoding version: {version}")
+
+        self.data = data
+        self.version = data[0]
+        self.offset = 1
+
+    def varint(self) -> int:
+        value = 0
+        shift = 0
+        while True:
+            byte = self.data[self.offset]
+            self.offset += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def signed(self) -> int:
+        value = self.varint()
+        return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+    def string(self) -> str:
+        length = self.varint()
+        data = self.data[self.offset : self.offset + length]
+        self.offset += length
+        return data.decode()
+
+    def move(self) -> Move:
+        (packed,) = U16.unpack_from(self.data, self.offset)
+        self.offset += 2
+        return unpack_move(packed)
+
+    def moves(self) -> list[Move]:
+        return [self.move() for _ in range(self.varint())]
+
+    def score(self, turn: chess.Color) -> PovScore:
+        value = self.signed()
+        if value & 1:
+            score = Mate(value >> 1)
+        else:
+            score = Cp(value >> 1)
+
+        if turn != chess.WHITE:
+            score = -score
+        return PovScore(score, turn)
+
+
+def encode_top_moves(top_moves: list[MoveStats]) -> bytes:
+    writer = Writer()
+    writer.varint(len(top_moves))
+    for stats in top_moves:
+        writer.move(stats.move)
+        writer.varint(stats.white)
+        writer.varint(stats.draws)
+        writer.varint(stats.black)
+    return writer.getvalue()
+
+
+def decode_top_moves(data: bytes) -> list[MoveStats]:
+    reader = Reader(data)
+    top_moves = []
+    for _ in range(reader.varint()):
+        move = reader.move()
+        white = reader.varint()
+        draws = reader.varint()
+        black = reader.varint()
+        top_moves.append(MoveStats(move, white=white, black=black, draws=draws))
+    return top_moves
+
+
+def encode_analysis(analysis: Analysis) -> bytes:
+    writer = Writer()
+    writer.string(analysis.engine)
+    writer.varint(analysis.depth)
+    writer.varint(analysis.turn if analysis.result else chess.WHITE)
+    writer.varint(len(analysis.result))
+    for scored_pv in analysis.result:
+        writer.score(scored_pv.score)
+        writer.moves(scored_pv.pv)
+    return writer.getvalue()
+
+
+def decode_analysis(data: bytes) -> Analysis:
+    reader = Reader(data)
+    engine = reader.string()
+    depth = reader.varint()
+    turn = bool(reader.varint())
+
+    result = []
+    for _ in range(reader.varint()):
+        score = reader.score(turn)
+        result.append(ScoredPV(pv=reader.moves(), score=score))
+
+    return Analysis(engine=engine, depth=depth, result=result)
+
+
+def encode_tactic(tactic: Tactic) -> bytes:
+    writer = Writer()
+    writer.string(tactic.meta.start_fen)
+    writer.moves(tactic.variation)
+    writer.score(tactic.score)
+    writer.moves(tactic.solution)
+    writer.signed(tactic.meta.material)
+    writer.string(tactic.meta.variation_san)
+    writer.string(tactic.meta.solution_san)
+    writer.string(tactic.meta.line_san)
+    return writer.getvalue()
+
+
+def decode_tactic(data: bytes) -> Tactic:
+    reader = Reader(data)
+    start_fen = reader.string()
+    position = Board(start_fen)
+    for move in reader.moves():
+        position.push(move)
+    score = reader.score(position.turn)
+    solution = reader.moves()
+
+    # without stored metadata the tactic computes it
+    metadata = None
+    if reader.version >= 2:
+        metadata = TacticMetadata(
+            material=reader.signed(),
+            start_fen=start_fen,
+            variation_san=reader.string(),
+            solution_san=reader.string(),
+            line_san=reader.string(),
+        )
+
+    return Tactic(
+        position=position,
+        score=score,
+        solution=solution,
+        metadata=metadata,
+    )
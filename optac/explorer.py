@@ -1,10 +1,11 @@
-from collections import deque
+import json
 from typing import Iterator
 
 from chess import Board, Move
 
-from optac.lichess import LichessAPI, MoveStats
-from optac.position_store import PositionStore
+from optac.lichess import LichessAPI, MoveStats, MoveStatsProvider
+from optac.position_store import Position, PositionStore
+from optac.util import position_key
 
 
 class LichessExplorer:
@@ -16,6 +17,7 @@ class LichessExplorer:
         min_games: int | None = None,
         top_percent: int | None = None,
         top_n: int | None = None,
+        lichess: MoveStatsProvider | None = None,
     ):
         self.start = start_fen
         self.store = store
@@ -26,7 +28,15 @@ class LichessExplorer:
         self.top_n = top_n
         assert top_percent or top_n, "top_percent or top_n must be set"
 
-        self.lichess = LichessAPI()
+        # any provider of move statistics, an opening index or a Polyglot
+        # book instead of the explorer API
+        if lichess is None:
+            lichess = LichessAPI()
+        self.lichess = lichess
+
+        # The tree is a DAG: every position is expanded once, but all move
+        # orders reaching it are kept for reporting.
+        self.move_orders: dict[int, list[list[Move]]] = {}
 
     def filter_top_moves(self, moves: list[MoveStats]) -> Iterator[Move]:
         if self.top_percent is not None:
@@ -48,28 +58,75 @@ class LichessExplorer:
                 if cumulative > self.top_percent / 100:
                     return
 
-    def __iter__(self) -> Iterator[Board]:
-        return self.search_moves()
-
-    def search_moves(self) -> Iterator[Board]:
-        queue = deque([Board(self.start)])
-        while queue:
-            board = queue.popleft()
-            yield board
-
-            if self.max_depth is not None and len(board.move_stack) < self.max_depth:
-                next_moves = []
-
-                with self.store.load(board) as position:
-                    if position.in_tactic:
-                        forced_move = position.tactic.solution[position.tactic_ply]
-                        next_moves.append(forced_move)
-                    else:
-                        if not position.top_moves:
-                            position.top_moves = self.lichess.get(board)
-                        next_moves.extend(self.filter_top_moves(position.top_moves))
-
-                for move in next_moves:
-                    next_board = board.copy()
-                    next_board.push(move)
-                    queue.append(next_board)
+    def visit(self, board: Board) -> bool:
+        key = position_key(board)
+        move_orders = self.move_orders.setdefault(key, [])
+        move_orders.append(list(board.move_stack))
+
+        if len(move_orders) > 1:
+            return False
+
+        self.store.add_visited(key, board.move_stack)
+        return True
+
+    def restore(self):
+        for key, moves in self.store.visited():
+            self.move_orders[key] = [moves]
+
+    def first_move_order(self, board: Board) -> list[Move]:
+        return self.move_orders[position_key(board)][0]
+
+    def transpositions(self) -> dict[int, list[list[Move]]]:
+        return {
+            key: move_orders
+            for key, move_orders in self.move_orders.items()
+            if len(move_orders) > 1
+        }
+
+    def is_expanded(self, board: Board) -> bool:
+        return self.max_depth is not None and len(board.move_stack) < self.max_depth
+
+    # Identifies how a position is expanded, to tell whether an earlier run
+    # expanded it the same way.
+    def expansion(self, board: Board, position: Position) -> str:
+        if not self.is_expanded(board):
+            return "leaf"
+        if position.in_tactic:
+            return f"tactic {position.tactic_ply}"
+        return json.dumps(
+            [self.top_n, self.top_percent, self.min_games, self.lichess.source]
+        )
+
+    def needs_top_moves(self, board: Board, position: Position) -> bool:
+        # top moves of other speeds, ratings or providers are not mixed in
+        return (
+            self.is_expanded(board)
+            and not position.in_tactic
+            and (
+                not position.top_moves
+                or position.top_moves_source != self.lichess.source
+            )
+        )
+
+    async def fetch_top_moves(self, board: Board) -> list[MoveStats]:
+        return await self.lichess.get(board)
+
+    def next_moves(self, position: Position) -> list[Move]:
+        if position.in_tactic:
+            return [position.tactic.solution[position.tactic_ply]]
+
+        if position.top_moves is None:
+            raise ValueError(f"Top moves not fetched, {position.fen}")
+        return list(self.filter_top_moves(position.top_moves))
+
+    def expand(self, board: Board, position: Position) -> list[Board]:
+        if not self.is_expanded(board):
+            return []
+
+        next_boards = []
+        for move in self.next_moves(position):
+            next_board = board.copy()
+            next_board.push(move)
+            next_boards.append(next_board)
+
+        return next_boards
@@ -0,0 +1,118 @@
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+
+def default_cache_path(name: str = "explorer.sqlite3") -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "optac" / name
+
+
+def normalize_fen(fen: str) -> str:
+    # move clocks do not change the explorer response
+    return " ".join(fen.split(" ")[:4])
+
+
+def cache_key(url: str, query: dict) -> str:
+    query = dict(query)
+    query["fen"] = normalize_fen(query["fen"])
+    return url + "?" + urlencode(sorted(query.items()))
+
+
+class ExplorerCache:
+    def __init__(
+        self,
+        path: Path | str,
+        ttl: float | None = 30 * 24 * 3600,
+        max_entries: int | None = None,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # several runs may share the cache, let them wait for each other
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                fetched REAL NOT NULL,
+                body TEXT NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_fetched ON responses (fetched)"
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.evict()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+        return count
+
+    def get(self, url: str, query: dict) -> dict | None:
+        row = self.connection.execute(
+            "SELECT fetched, body FROM responses WHERE key = ?",
+            (cache_key(url, query),),
+        ).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        fetched, body = row
+        if self.ttl is not None and time.time() - fetched > self.ttl:
+            self.expired += 1
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(body)
+
+    def put(self, url: str, query: dict, response: dict):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, fetched, body) VALUES (?, ?, ?)",
+                (cache_key(url, query), time.time(), json.dumps(response)),
+            )
+
+    def evict(self):
+        with self.connection:
+            if self.ttl is not None:
+                self.connection.execute(
+                    "DELETE FROM responses WHERE fetched < ?",
+                    (time.time() - self.ttl,),
+                )
+
+            if self.max_entries is not None:
+                self.connection.execute(
+                    """
+                    DELETE FROM responses WHERE key IN (
+                        SELECT key FROM responses
+                        ORDER BY fetched DESC, rowid DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,),
+                )
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "expired": self.expired}
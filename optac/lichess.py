@@ -1,8 +1,16 @@
+import asyncio
+import time
 from dataclasses import dataclass
+from typing import Protocol
 
 import backoff
 from chess import Board, Move
 import requests
+from requests.adapters import HTTPAdapter
+
+from optac.explorer_cache import ExplorerCache
+from optac import trace
+from optac.metrics import metrics
 
 
 @dataclass
@@ -25,35 +33,169 @@ class MoveStats:
             draws=move["draws"],
         )
 
+    @classmethod
+    def from_dict(cls, move_dict: dict):
+        return cls.from_lichess(move_dict)
+
+    def as_dict(self):
+        return {
+            "uci": self.move.uci(),
+            "white": self.white,
+            "black": self.black,
+            "draws": self.draws,
+        }
+
+
+# Where the explorer gets the moves played in a position, most played first.
+# The source names the provider and the games it counts, stored top moves
+# from another source are fetched again.
+class MoveStatsProvider(Protocol):
+    @property
+    def source(self) -> str: ...
+
+    async def get(self, board: Board) -> list[MoveStats]: ...
+
+    def close(self): ...
+
 
 class LichessLimitReached(Exception):
-    pass
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str | None, default: float) -> float:
+    try:
+        return max(float(value), 0.0)  # type: ignore[arg-type]
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
 
 
 class LichessAPI:
-    def get(self, board: Board):
+    def __init__(
+        self,
+        url: str = "https://explorer.lichess.ovh/lichess",
+        speeds: str = "bullet,blitz,rapid,classical,correspondence",
+        ratings: str = "1600,1800,2000,2200,2500",
+        cache: ExplorerCache | None = None,
+        max_requests: int = 1,
+        requests_per_second: float = 1.0,
+        retry_after: float = 60.0,
+        timeout: float = 30.0,
+    ):
+        self.url = url
+        self.speeds = speeds
+        self.ratings = ratings
+        self.cache = cache
+        self.max_requests = max_requests
+        self.retry_after = retry_after
+        self.timeout = timeout
+
+        # one keep-alive connection per request in flight
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_requests)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.in_flight = asyncio.Semaphore(max_requests)
+        self.bucket = TokenBucket(requests_per_second, burst=max_requests)
+
+    @property
+    def source(self) -> str:
+        speeds = ",".join(sorted(self.speeds.split(",")))
+        ratings = ",".join(sorted(self.ratings.split(",")))
+        return f"{self.url}?speeds={speeds}&ratings={ratings}"
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    async def get(self, board: Board) -> list[MoveStats]:
         fen = board.fen()
-        response = self.fetch(fen)
+        response = await self.fetch(fen)
 
         moves = [MoveStats.from_lichess(move) for move in response["moves"]]
         moves = sorted(moves, key=lambda move: move.games, reverse=True)
 
         return [move for move in moves]
 
-    @backoff.on_exception(backoff.constant, LichessLimitReached, interval=60)
-    def fetch(self, fen: str) -> dict:
-        url = "https://explorer.lichess.ovh/lichess"
+    async def fetch(self, fen: str) -> dict:
+        with metrics.timer("lichess_fetch_seconds"):
+            return await self.lookup(fen)
+
+    async def lookup(self, fen: str) -> dict:
         query = {
-            "speeds": "bullet,blitz,rapid,classical,correspondence",
-            "ratings": "1600,1800,2000,2200,2500",
+            "speeds": self.speeds,
+            "ratings": self.ratings,
             "fen": fen,
             "topGames": 0,
             "recentGames": 0,
         }
-        response = requests.get(url, query)
+
+        if self.cache is not None:
+            response = self.cache.get(self.url, query)
+            if response is not None:
+                metrics.inc("lichess_cache_hits_total")
+                return response
+            metrics.inc("lichess_cache_misses_total")
+
+        response = await self.request(query)
+
+        if self.cache is not None:
+            self.cache.put(self.url, query, response)
+
+        return response
+
+    # only the rate limited request waits, others keep going
+    @backoff.on_exception(
+        backoff.runtime,
+        LichessLimitReached,
+        value=lambda e: e.retry_after,
+        jitter=None,
+    )
+    async def request(self, query: dict) -> dict:
+        async with self.in_flight:
+            await self.bucket.acquire()
+            metrics.inc("lichess_requests_total")
+            # requests is blocking, keep it off the event loop
+            with metrics.timer("lichess_request_seconds") as span:
+                response = await asyncio.to_thread(
+                    self.session.get, self.url, params=query, timeout=self.timeout
+                )
+                span["status"] = response.status_code
 
         if response.status_code == 429:
-            raise LichessLimitReached()
+            metrics.inc("lichess_rate_limited_total")
+            retry_after = parse_retry_after(
+                response.headers.get("Retry-After"), self.retry_after
+            )
+            trace.event("lichess_rate_limited", retry_after=retry_after)
+            raise LichessLimitReached(retry_after)
         response.raise_for_status()
 
         return response.json()
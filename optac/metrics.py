@@ -0,0 +1,241 @@
+import asyncio
+import os
+import sys
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, TextIO
+
+from optac import trace
+
+# seconds, from a cache hit to a deep engine search
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+DESCRIPTIONS = {
+    "lichess_fetch_seconds": "Explorer lookups, cached or not, including retries",
+    "lichess_request_seconds": "HTTP requests to the opening explorer",
+    "lichess_requests_total": "HTTP requests to the opening explorer",
+    "lichess_rate_limited_total": "Explorer requests answered with 429",
+    "lichess_cache_hits_total": "Explorer lookups served by the cache",
+    "lichess_cache_misses_total": "Explorer lookups not in the cache",
+    "engine_analyse_seconds": "Engine searches",
+    "analysis_cache_hits_total": "Analyses served by the analysis cache",
+    "analysis_cache_misses_total": "Analyses not in the analysis cache",
+    "position_load_seconds": "Positions loaded from the position store",
+    "position_commit_seconds": "Positions committed to the position store",
+    "position_cache_hits_total": "Positions found in the store cache",
+    "position_cache_misses_total": "Positions read from the database",
+    "tactic_find_seconds": "Tactic.find_in_position, with its engine searches",
+    "search_positions_queued_total": "Positions queued by the search",
+    "search_positions_total": "Positions committed by the search",
+    "search_tactics_total": "New tactics found by the search",
+    "search_frontier_jobs": "Positions waiting for top moves",
+    "search_unanalysed_jobs": "Positions waiting for an engine",
+    "search_analysed_jobs": "Positions waiting to be committed",
+}
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        # the last count is for values above all buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+# Counters, gauges and latency histograms of a process, written in the
+# Prometheus text format. Metrics exist once they are first updated.
+class Metrics:
+    def __init__(self, prefix: str = "optac"):
+        self.prefix = prefix
+        self.counters: dict[str, float] = {}
+        self.gauges: dict[str, float] = {}
+        self.histograms: dict[str, Histogram] = {}
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+    def inc(self, name: str, value: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        self.histograms[name].observe(value)
+
+    # timed stages are spans of a trace as well
+    @contextmanager
+    def timer(self, name: str, **args) -> Iterator[dict]:
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            self.observe(name, end - start)
+            trace.record(name.removesuffix("_seconds"), start, end, args)
+
+    def count(self, name: str) -> float:
+        if name in self.histograms:
+            return self.histograms[name].count
+        return self.counters.get(name, self.gauges.get(name, 0))
+
+    def mean(self, name: str) -> float:
+        histogram = self.histograms.get(name)
+        return histogram.mean if histogram is not None else 0.0
+
+    def render(self) -> str:
+        lines = []
+
+        def header(name: str, kind: str):
+            description = DESCRIPTIONS.get(name)
+            if description is not None:
+                lines.append(f"# HELP {self.prefix}_{name} {description}")
+            lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+        for name, value in sorted(self.counters.items()):
+            header(name, "counter")
+            lines.append(f"{self.prefix}_{name} {value:g}")
+
+        for name, value in sorted(self.gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{self.prefix}_{name} {value:g}")
+
+        for name, histogram in sorted(self.histograms.items()):
+            header(name, "histogram")
+            metric = f"{self.prefix}_{name}"
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{metric}_sum {histogram.sum:.6f}")
+            lines.append(f"{metric}_count {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path):
+        # the textfile collector must never read a partial file
+        partial = path.with_name(path.name + ".tmp")
+        partial.write_text(self.render())
+        os.replace(partial, path)
+
+
+# the metrics of optac itself, updated by the instrumented stages
+metrics = Metrics()
+
+
+def status(metrics: Metrics, elapsed: float, engines: int) -> str:
+    positions = metrics.count("search_positions_total")
+    queued = metrics.count("search_positions_queued_total")
+    requests = metrics.count("lichess_requests_total")
+    cached = metrics.count("lichess_cache_hits_total")
+    lookups = cached + metrics.count("lichess_cache_misses_total")
+    engine = metrics.histograms.get("engine_analyse_seconds", Histogram())
+    rate = positions / elapsed if elapsed else 0.0
+    utilization = engine.sum / (elapsed * engines) if elapsed and engines else 0.0
+
+    return " | ".join(
+        [
+            f"{positions:.0f}/{queued:.0f} positions, {rate:.1f}/s",
+            "queues {:.0f} fetch, {:.0f} engine, {:.0f} commit".format(
+                metrics.count("search_frontier_jobs"),
+                metrics.count("search_unanalysed_jobs"),
+                metrics.count("search_analysed_jobs"),
+            ),
+            "lichess {:.0f} requests, {:.0f} limited, {:.0%} cached, {:.2f}s".format(
+                requests,
+                metrics.count("lichess_rate_limited_total"),
+                cached / lookups if lookups else 0,
+                metrics.mean("lichess_request_seconds"),
+            ),
+            f"engine {engine.count} searches, {engine.mean:.2f}s, {utilization:.0%} busy",
+            f"{metrics.count('search_tactics_total'):.0f} tactics",
+        ]
+    )
+
+
+# A status line redrawn in place on a terminal and a metrics file rewritten
+# periodically. Report lines are printed above the status line.
+class Progress:
+    def __init__(
+        self,
+        metrics: Metrics = metrics,
+        engines: int = 1,
+        live: bool | None = None,
+        textfile: Path | None = None,
+        interval: float = 1.0,
+        textfile_interval: float = 15.0,
+        stream: TextIO | None = None,
+        output: TextIO | None = None,
+    ):
+        self.metrics = metrics
+        self.engines = engines
+        self.stream = stream or sys.stderr
+        self.output = output or sys.stdout
+        self.live = self.stream.isatty() if live is None else live
+        self.textfile = textfile
+        self.interval = interval
+        self.textfile_interval = textfile_interval
+
+        self.start = time.monotonic()
+        self.written = self.start
+        self.drawn = False
+
+    def status(self) -> str:
+        return status(self.metrics, time.monotonic() - self.start, self.engines)
+
+    def clear(self):
+        if self.drawn:
+            self.stream.write("\r\033[K")
+            self.drawn = False
+
+    def draw(self):
+        if self.live:
+            self.stream.write("\r\033[K" + self.status())
+            self.stream.flush()
+            self.drawn = True
+
+    def print(self, *fields: object):
+        self.clear()
+        print(*fields, sep="\t", file=self.output, flush=self.live)
+        self.draw()
+
+    def update(self, sample: Callable[[], None] | None = None):
+        if sample is not None:
+            sample()
+        self.draw()
+
+        now = time.monotonic()
+        if self.textfile is not None and now - self.written >= self.textfile_interval:
+            self.metrics.write(self.textfile)
+            self.written = now
+
+    async def run(self, sample: Callable[[], None] | None = None):
+        # runs until cancelled
+        while True:
+            await asyncio.sleep(self.interval)
+            self.update(sample)
+
+    def close(self):
+        self.clear()
+        if self.live:
+            self.stream.write(self.status() + "\n")
+            self.stream.flush()
+        if self.textfile is not None:
+            self.metrics.write(self.textfile)
@@ -0,0 +1,10 @@
+from .build import GameFilter, build_index
+from .index import OpeningIndex
+from .polyglot import PolyglotBook
+
+__all__ = [
+    "GameFilter",
+    "OpeningIndex",
+    "PolyglotBook",
+    "build_index",
+]
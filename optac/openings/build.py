@@ -0,0 +1,292 @@
+import bz2
+import gzip
+import heapq
+import io
+import os
+import re
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, Iterable, Iterator, TextIO
+
+from chess import Board
+
+from optac.openings.index import RECORD, entry, write_index
+
+# lower bounds of the rating groups of the Lichess explorer
+RATING_GROUPS = (0, 1000, 1200, 1400, 1600, 1800, 2000, 2200, 2500)
+RESULTS = {"1-0": 0, "1/2-1/2": 1, "0-1": 2}
+
+HEADER = re.compile(r'\[(\w+)\s+"(.*)"\]')
+# comments, variations without nesting, NAGs, move numbers and results
+MOVETEXT_NOISE = re.compile(
+    r"\{[^}]*\}|;[^\n]*|\([^()]*\)|\$\d+|\d+\.(\.\.)?|1-0|0-1|1/2-1/2|\*"
+)
+
+
+def rating_group(rating: float) -> int:
+    group = RATING_GROUPS[0]
+    for bound in RATING_GROUPS:
+        if rating >= bound:
+            group = bound
+    return group
+
+
+def game_speed(time_control: str) -> str | None:
+    # the estimated duration of the game, as Lichess classifies it
+    if time_control == "-":
+        return "correspondence"
+    try:
+        initial, increment = (int(part) for part in time_control.split("+"))
+    except ValueError:
+        return None
+
+    duration = initial + 40 * increment
+    if duration < 30:
+        return "ultraBullet"
+    if duration < 180:
+        return "bullet"
+    if duration < 480:
+        return "blitz"
+    if duration < 1500:
+        return "rapid"
+    return "classical"
+
+
+# Games counted by the index, with the speeds and ratings parameters of the
+# explorer API. Ratings are the lower bounds of the rating groups.
+@dataclass(frozen=True)
+class GameFilter:
+    speeds: frozenset[str]
+    ratings: frozenset[int]
+
+    @classmethod
+    def from_params(cls, speeds: str, ratings: str):
+        return cls(
+            speeds=frozenset(speeds.split(",")),
+            ratings=frozenset(int(rating) for rating in ratings.split(",")),
+        )
+
+    def accepts(self, headers: dict[str, str]) -> bool:
+        if headers.get("Result") not in RESULTS:
+            return False
+        if game_speed(headers.get("TimeControl", "")) not in self.speeds:
+            return False
+
+        try:
+            average = (int(headers["WhiteElo"]) + int(headers["BlackElo"])) / 2
+        except (KeyError, ValueError):
+            return False
+        return rating_group(average) in self.ratings
+
+
+def open_pgn(path: Path) -> TextIO:
+    if path.suffix == ".bz2":
+        return bz2.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.suffix == ".zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError(
+                f"Reading {path} needs zstandard, "
+                "install it with 'pip install optac[zstd]'"
+            ) from None
+
+        # Lichess dumps are concatenated frames with windows larger than the
+        # default, a reader stops after the first frame unless told otherwise
+        decompressor = zstandard.ZstdDecompressor(max_window_size=2**31)
+        stream = decompressor.stream_reader(
+            open(path, "rb"), read_across_frames=True, closefd=True
+        )
+        return io.TextIOWrapper(stream, encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def split_games(lines: Iterable[str]) -> Iterator[str]:
+    # a game ends where the headers of the next one start
+    game: list[str] = []
+    in_movetext = False
+    for line in lines:
+        if line.startswith("["):
+            if in_movetext:
+                yield "".join(game)
+                game = []
+                in_movetext = False
+        elif line.strip():
+            in_movetext = True
+        game.append(line)
+
+    if in_movetext:
+        yield "".join(game)
+
+
+def parse_game(text: str) -> tuple[dict[str, str], list[str]]:
+    headers = {}
+    movetext = []
+    for line in text.splitlines():
+        match = HEADER.match(line) if line.startswith("[") else None
+        if match is not None:
+            headers[match[1]] = match[2]
+        else:
+            movetext.append(line)
+
+    sans = MOVETEXT_NOISE.sub(" ", " ".join(movetext)).split()
+    return headers, [san.rstrip("!?") for san in sans]
+
+
+# Runs in a worker process. Only the first max_ply moves of a game are
+# replayed, the headers are checked before any move is.
+def count_games(
+    games: list[str],
+    game_filter: GameFilter,
+    max_ply: int,
+) -> tuple[dict[int, list[int]], int]:
+    counts: dict[int, list[int]] = {}
+    counted = 0
+
+    for text in games:
+        headers, sans = parse_game(text)
+        if not game_filter.accepts(headers):
+            continue
+
+        counted += 1
+        result = RESULTS[headers["Result"]]
+        board = Board()
+        for san in sans[:max_ply]:
+            try:
+                move = board.parse_san(san)
+            except ValueError:
+                break
+
+            combined = entry(board, move)
+            if combined not in counts:
+                counts[combined] = [0, 0, 0]
+            counts[combined][result] += 1
+            board.push(move)
+
+    return counts, counted
+
+
+def merge_counts(counts: dict[int, list[int]], chunk: dict[int, list[int]]):
+    for combined, added in chunk.items():
+        total = counts.get(combined)
+        if total is None:
+            counts[combined] = added
+        else:
+            total[0] += added[0]
+            total[1] += added[1]
+            total[2] += added[2]
+
+
+# Counts beyond the memory of the builder are spilled to runs, files of
+# records sorted like the index, merged into the index at the end.
+def write_run(path: Path, counts: dict[int, list[int]]) -> Path:
+    with open(path, "wb") as f:
+        for combined in sorted(counts):
+            white, draws, black = counts[combined]
+            f.write(RECORD.pack(combined >> 16, combined & 0xFFFF, white, draws, black))
+    return path
+
+
+def read_run(path: Path) -> Iterator[tuple]:
+    with open(path, "rb") as f:
+        while block := f.read(RECORD.size * 4096):
+            yield from RECORD.iter_unpack(block)
+
+
+def merge_runs(paths: list[Path], min_games: int = 1) -> Iterator[tuple]:
+    # a move counted in several runs is summed before min_games is applied
+    current: list[int] | None = None
+    for record in heapq.merge(*(read_run(path) for path in paths)):
+        if current is not None and current[0] == record[0] and current[1] == record[1]:
+            current[2] += record[2]
+            current[3] += record[3]
+            current[4] += record[4]
+            continue
+
+        if current is not None and sum(current[2:]) >= min_games:
+            yield tuple(current)
+        current = list(record)
+
+    if current is not None and sum(current[2:]) >= min_games:
+        yield tuple(current)
+
+
+def chunks(games: Iterator[str], size: int) -> Iterator[list[str]]:
+    while chunk := list(islice(games, size)):
+        yield chunk
+
+
+def bounded_map(
+    pool: Executor,
+    function: Callable,
+    items: Iterable,
+    limit: int,
+) -> Iterator:
+    # reading the dump stays only a few chunks ahead of the workers
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(function, item))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def build_index(
+    paths: list[Path],
+    output: Path,
+    speeds: str,
+    ratings: str,
+    max_ply: int = 30,
+    min_games: int = 1,
+    processes: int | None = None,
+    chunk_size: int = 1000,
+    run_size: int = 2_000_000,
+) -> tuple[int, int]:
+    # returns the number of games counted and of moves in the index, at most
+    # run_size moves are counted in memory
+    game_filter = GameFilter.from_params(speeds, ratings)
+    count = partial(count_games, game_filter=game_filter, max_ply=max_ply)
+    workers = processes or os.cpu_count() or 1
+
+    # the runs of a dump can be as large as the dump, keep them next to the index
+    with TemporaryDirectory(dir=output.parent, prefix=".build-index-") as directory:
+        runs: list[Path] = []
+
+        def spill(counts: dict[int, list[int]]):
+            runs.append(write_run(Path(directory) / f"run-{len(runs)}", counts))
+
+        counts: dict[int, list[int]] = {}
+        games = 0
+        with ProcessPoolExecutor(workers) as pool:
+            for path in paths:
+                with open_pgn(path) as f:
+                    chunked = chunks(split_games(f), chunk_size)
+                    for chunk, counted in bounded_map(
+                        pool, count, chunked, 2 * workers
+                    ):
+                        merge_counts(counts, chunk)
+                        games += counted
+                        if len(counts) >= run_size:
+                            spill(counts)
+                            counts = {}
+        spill(counts)
+        # the merge only reads the runs
+        counts.clear()
+
+        info = {
+            "speeds": speeds,
+            "ratings": ratings,
+            "max_ply": max_ply,
+            "min_games": min_games,
+            "games": games,
+        }
+        return games, write_index(output, merge_runs(runs, min_games), info)
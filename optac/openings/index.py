@@ -0,0 +1,92 @@
+import json
+import struct
+from pathlib import Path
+from typing import Iterable
+
+import chess.polyglot
+from chess import Board, Move
+
+from optac.lichess import MoveStats
+from optac.openings.mapped import MappedRecords
+from optac.util import pack_move, unpack_move
+
+MAGIC = b"OPTACIDX"
+VERSION = 1
+
+# magic, version and length of the JSON description that follows
+HEADER = struct.Struct("<8sII")
+# Zobrist key of the position, move, white wins, draws and black wins
+RECORD = struct.Struct("<QHIII")
+
+
+# Entries combine the Zobrist key and the encoded move into one integer, so
+# sorting them sorts the records by position and move.
+def entry(board: Board, move: Move) -> int:
+    return chess.polyglot.zobrist_hash(board) << 16 | pack_move(move)
+
+
+# Records are (key, move, white, draws, black) tuples sorted by key and move.
+def write_index(path: Path, records: Iterable[tuple], info: dict) -> int:
+    description = json.dumps(info).encode()
+
+    written = 0
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(description)))
+        f.write(description)
+        for record in records:
+            f.write(RECORD.pack(*record))
+            written += 1
+
+    return written
+
+
+# Move statistics of an offline index, served like the explorer serves them.
+class OpeningIndex:
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+
+        with open(self.path, "rb") as f:
+            magic, version, length = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"Not an opening index, {self.path}")
+            if version != VERSION:
+                raise ValueError(f"Unsupported opening index version {version}")
+            # the filters the index was built with
+            self.info: dict = json.loads(f.read(length))
+
+        self.records = MappedRecords(self.path, RECORD, HEADER.size + length)
+
+    def close(self):
+        self.records.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def source(self) -> str:
+        return f"index {self.path.resolve()}"
+
+    def counts(self, speeds: str, ratings: str) -> bool:
+        # whether the index counts the games of these explorer parameters,
+        # in whatever order they are listed
+        return all(
+            set(self.info.get(name, "").split(",")) == set(value.split(","))
+            for name, value in (("speeds", speeds), ("ratings", ratings))
+        )
+
+    def moves(self, board: Board) -> list[MoveStats]:
+        records = self.records.find(chess.polyglot.zobrist_hash(board))
+        moves = [
+            MoveStats(move=unpack_move(move), white=white, black=black, draws=draws)
+            for _, move, white, draws, black in records
+        ]
+        return sorted(moves, key=lambda move: move.games, reverse=True)
+
+    async def get(self, board: Board) -> list[MoveStats]:
+        return self.moves(board)
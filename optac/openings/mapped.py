@@ -0,0 +1,58 @@
+import mmap
+import struct
+from pathlib import Path
+
+
+# Fixed size records sorted by a 64 bit key at their start, read through a
+# memory map. A lookup is a binary search touching a few pages, the file is
+# never loaded as a whole.
+class MappedRecords:
+    def __init__(self, path: Path | str, record: struct.Struct, offset: int = 0):
+        self.path = Path(path)
+        self.record = record
+        self.offset = offset
+        # the key is the first field, in the byte order of the record
+        self.key_format = struct.Struct(record.format[0] + "Q")
+
+        self.file = open(self.path, "rb")
+        size = self.path.stat().st_size - offset
+        if size % record.size:
+            self.file.close()
+            raise ValueError(f"Truncated file, {self.path}")
+
+        self.count = size // record.size
+        # an empty file cannot be mapped, it has no records to read either
+        self.map: mmap.mmap | bytes = b""
+        if offset + size > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+    def key(self, index: int) -> int:
+        position = self.offset + index * self.record.size
+        return self.key_format.unpack_from(self.map, position)[0]
+
+    def unpack(self, index: int) -> tuple:
+        return self.record.unpack_from(self.map, self.offset + index * self.record.size)
+
+    def find(self, key: int) -> list[tuple]:
+        # first record with the key, then all following with the same key
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        found = []
+        while low < self.count and self.key(low) == key:
+            found.append(self.unpack(low))
+            low += 1
+        return found
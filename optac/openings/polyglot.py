@@ -0,0 +1,55 @@
+from pathlib import Path
+
+import chess.polyglot
+from chess import Board, Move
+
+from optac.lichess import MoveStats
+
+
+# Moves of a Polyglot opening book. python-chess maps the book to memory and
+# finds the entries of a position by binary search on their Zobrist keys.
+#
+# A book knows how often or how much a move is played, not how the games
+# ended: the weight is counted as games won by the side to move. The learn
+# field has no agreed meaning between book makers and is not used.
+class PolyglotBook:
+    def __init__(self, path: Path | str, minimum_weight: int = 1):
+        self.path = Path(path)
+        self.minimum_weight = minimum_weight
+        self.reader = chess.polyglot.open_reader(self.path)
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.reader)
+
+    @property
+    def source(self) -> str:
+        return f"book {self.path.resolve()} {self.minimum_weight}"
+
+    def moves(self, board: Board) -> list[MoveStats]:
+        # books may list a move more than once, castling as king takes rook
+        weights: dict[Move, int] = {}
+        for entry in self.reader.find_all(board, minimum_weight=self.minimum_weight):
+            weights[entry.move] = weights.get(entry.move, 0) + entry.weight
+
+        moves = [
+            MoveStats(
+                move=move,
+                white=weight if board.turn == chess.WHITE else 0,
+                black=weight if board.turn == chess.BLACK else 0,
+                draws=0,
+            )
+            for move, weight in weights.items()
+        ]
+        return sorted(moves, key=lambda move: move.games, reverse=True)
+
+    async def get(self, board: Board) -> list[MoveStats]:
+        return self.moves(board)
@@ -1,3 +1,10 @@
-from .html import render_html
+from .diagrams import DiagramCache, DiagramRenderer
+from .html import render_html, render_pages, write_html
 
-__all__ = ["render_html"]
+__all__ = [
+    "DiagramCache",
+    "DiagramRenderer",
+    "render_html",
+    "render_pages",
+    "write_html",
+]
@@ -0,0 +1,123 @@
+import hashlib
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import chess
+from chess import Board, Color, Move
+from chess.svg import board as render_svg
+
+# worker processes only pay off for larger batches
+PARALLEL_THRESHOLD = 64
+
+# position FEN, orientation and UCI of the last move
+Diagram = tuple[str, Color, str | None]
+
+
+def diagram_key(diagram: Diagram) -> str:
+    # a new python-chess version may draw differently
+    fen, orientation, lastmove = diagram
+    data = f"{chess.__version__} {fen} {int(orientation)} {lastmove or '-'}"
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def render_diagram(diagram: Diagram) -> str:
+    fen, orientation, lastmove = diagram
+    return render_svg(
+        Board(fen),
+        orientation=orientation,
+        lastmove=Move.from_uci(lastmove) if lastmove else None,
+    )
+
+
+# Rendered SVGs, addressed by the hash of what they show.
+class DiagramCache:
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS diagrams (key TEXT PRIMARY KEY, svg TEXT NOT NULL)"
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM diagrams").fetchone()
+        return count
+
+    def get_many(self, keys: list[str]) -> dict[str, str]:
+        found = {}
+        # stay below the limit of SQL variables
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            query = f"SELECT key, svg FROM diagrams WHERE key IN ({', '.join('?' * len(chunk))})"
+            found.update(self.connection.execute(query, chunk))
+
+        self.hits += len(found)
+        self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, svgs: dict[str, str]):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO diagrams (key, svg) VALUES (?, ?)",
+                svgs.items(),
+            )
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class DiagramRenderer:
+    def __init__(self, cache: DiagramCache | None = None, processes: int | None = None):
+        self.cache = cache
+        self.processes = processes
+        self.pool: ProcessPoolExecutor | None = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def render(self, diagrams: list[Diagram]) -> list[str]:
+        keys = [diagram_key(diagram) for diagram in diagrams]
+        svgs = self.cache.get_many(keys) if self.cache is not None else {}
+
+        missing = {
+            key: diagram for key, diagram in zip(keys, diagrams) if key not in svgs
+        }
+        rendered = dict(zip(missing, self.render_all(list(missing.values()))))
+
+        if self.cache is not None and rendered:
+            self.cache.put_many(rendered)
+
+        svgs.update(rendered)
+        return [svgs[key] for key in keys]
+
+    def render_all(self, diagrams: list[Diagram]) -> list[str]:
+        if len(diagrams) < PARALLEL_THRESHOLD or self.processes == 1:
+            return [render_diagram(diagram) for diagram in diagrams]
+
+        # the pool is kept for the following pages
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.processes)
+        return list(self.pool.map(render_diagram, diagrams, chunksize=16))
@@ -1,57 +1,120 @@
+from itertools import islice
 from pathlib import Path
+from typing import Iterable, Iterator
 
 import chess
-from chess.svg import board as render_svg
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, Template
 
-from optac.tactic import Tactic
+from optac.output.diagrams import DiagramRenderer
+from optac.tactic_store import TacticRecord
 
+# diagrams are looked up and drawn this many at a time
+DIAGRAM_BATCH = 256
 
-def render_pgn(tactic: Tactic):
+
+def render_pgn(tactic: TacticRecord):
     pgn = '[Variant "From Position"]\n'
-    pgn += f'[FEN "{tactic.variation_start.fen()}"]\n\n'
-    pgn += tactic.variation_san(with_solution=True)
+    pgn += f'[FEN "{tactic.start_fen}"]\n\n'
+    pgn += tactic.meta.line_san
     return pgn
 
 
-def prepare_puzzles(tactics: list[Tactic]):
-    puzzles = []
+# Puzzles are produced one by one in the order of the tactics, sorting is
+# left to the store (TacticStore.iter_tactics(ordered=True)). Works on
+# stored records, so no tactic has to replay its moves.
+def iter_puzzles(tactics: Iterable[TacticRecord]) -> Iterator[dict]:
+    index = 1
     for tactic in tactics:
         if len(tactic.solution) < 2:
             continue
 
-        lastmove = tactic.position.move_stack[-1]
-        diagram = render_svg(
-            tactic.position,
-            orientation=tactic.color,
-            lastmove=lastmove,
-        )
-        puzzle = {
-            "svg": diagram,
+        lastmove = tactic.variation[-1]
+        yield {
+            "index": index,
+            "diagram": (tactic.fen, tactic.color, lastmove.uci()),
             "color": "white" if tactic.color == chess.WHITE else "black",
-            "fen": tactic.position.fen(),
-            "variation_san": tactic.variation_san(),
-            "solution_san": tactic.solution_san(),
+            "fen": tactic.fen,
+            "variation_san": tactic.meta.variation_san,
+            "solution_san": tactic.meta.solution_san,
             "pgn": render_pgn(tactic),
-            "ply": tactic.position.ply(),
+            "ply": tactic.ply,
         }
-        puzzles.append(puzzle)
-
-    # sort by color
-    puzzles.sort(key=lambda p: p["color"])
+        index += 1
 
-    # add puzzle number
-    puzzles = [{"index": i + 1, **p} for i, p in enumerate(puzzles)]
 
-    return puzzles
+def with_diagrams(
+    puzzles: Iterable[dict],
+    renderer: DiagramRenderer,
+) -> Iterator[dict]:
+    puzzles = iter(puzzles)
+    while batch := list(islice(puzzles, DIAGRAM_BATCH)):
+        svgs = renderer.render([puzzle["diagram"] for puzzle in batch])
+        for puzzle, svg in zip(batch, svgs):
+            yield {**puzzle, "svg": svg}
 
 
-def render_html(tactics: list[Tactic]) -> str:
-    puzzles = prepare_puzzles(tactics)
-
+def load_template() -> Template:
     jinja = Environment(
         loader=FileSystemLoader(Path(__file__).parent),
         autoescape=False,
     )
-    template = jinja.get_template("template.html")
-    return template.render(puzzles=puzzles)
+    return jinja.get_template("template.html")
+
+
+def render_html(
+    tactics: Iterable[TacticRecord],
+    renderer: DiagramRenderer | None = None,
+) -> str:
+    puzzles = with_diagrams(iter_puzzles(tactics), renderer or DiagramRenderer())
+    return "".join(load_template().generate(puzzles=puzzles))
+
+
+def write_html(
+    tactics: Iterable[TacticRecord],
+    path: Path,
+    renderer: DiagramRenderer | None = None,
+):
+    # the page is written while it is generated, never held in memory
+    puzzles = with_diagrams(iter_puzzles(tactics), renderer or DiagramRenderer())
+    load_template().stream(puzzles=puzzles).dump(str(path), encoding="utf-8")
+
+
+def page_path(path: Path, page: int) -> Path:
+    # the first page keeps the name, so links to the book stay valid
+    if page == 0:
+        return path
+    return path.with_name(f"{path.stem}-{page + 1}{path.suffix}")
+
+
+def render_pages(
+    tactics: Iterable[TacticRecord],
+    path: Path,
+    page_size: int,
+    renderer: DiagramRenderer | None = None,
+) -> list[Path]:
+    renderer = renderer or DiagramRenderer()
+    template = load_template()
+
+    # one puzzle is read ahead to know whether another page follows
+    puzzles = iter_puzzles(tactics)
+    following = next(puzzles, None)
+
+    paths = []
+    while True:
+        number = len(paths)
+        page = []
+        if following is not None:
+            page = [following, *islice(puzzles, page_size - 1)]
+        following = next(puzzles, None)
+
+        links = {
+            "number": number + 1,
+            "previous": page_path(path, number - 1).name if number > 0 else None,
+            "next": page_path(path, number + 1).name if following else None,
+        }
+        stream = template.stream(puzzles=with_diagrams(page, renderer), page=links)
+        stream.dump(str(page_path(path, number)), encoding="utf-8")
+        paths.append(page_path(path, number))
+
+        if following is None:
+            return paths
@@ -4,15 +4,34 @@ import json
 
 from chess.engine import ConfigMapping
 
+from optac.explorer_cache import default_cache_path
+
 
 @dataclass
 class EngineParams:
     exec: Path
-    depth: int
+    # search limits, any combination of depth, nodes and movetime (seconds)
+    depth: int | None = None
     options: ConfigMapping = field(default_factory=dict)
+    processes: int = 1
+    nodes: int | None = None
+    movetime: float | None = None
+    # total threads and hash (MB), split evenly between the processes
+    threads: int | None = None
+    hash: int | None = None
+    # re-analyse positions without a cached analysis at least this deep
+    deepen: bool = False
+    # screen positions at this depth, only analyse those at full depth whose
+    # best move is screen_threshold centipawns ahead of the second or mates
+    screen_depth: int | None = None
+    screen_threshold: int = 50
+    # send positions to the engine that analysed their parent
+    hash_affinity: bool = False
 
     def __post_init__(self):
         self.exec = Path(self.exec)
+        if self.depth is None and self.nodes is None and self.movetime is None:
+            raise ValueError("Engine params need a depth, nodes or movetime limit")
 
 
 @dataclass
@@ -23,11 +42,44 @@ class SearchParams:
     min_games: int | None = None
 
 
+@dataclass
+class LichessParams:
+    url: str = "https://explorer.lichess.ovh/lichess"
+    speeds: str = "bullet,blitz,rapid,classical,correspondence"
+    ratings: str = "1600,1800,2000,2200,2500"
+    # response cache shared between runs, null disables it
+    cache: Path | None = field(default_factory=default_cache_path)
+    cache_ttl_days: float | None = 30
+    cache_max_entries: int | None = None
+    # Lichess asks API clients for one request at a time, more concurrency
+    # is for explorers run elsewhere
+    max_requests: int = 1
+    requests_per_second: float = 1.0
+    retry_after: float = 60.0
+    # offline opening index (optac build-index) or Polyglot book used
+    # instead of the explorer
+    index: Path | None = None
+    book: Path | None = None
+    # book moves with a lower weight are ignored
+    book_min_weight: int = 1
+
+    def __post_init__(self):
+        if self.cache is not None:
+            self.cache = Path(self.cache).expanduser()
+        if self.index is not None:
+            self.index = Path(self.index).expanduser()
+        if self.book is not None:
+            self.book = Path(self.book).expanduser()
+        if self.index is not None and self.book is not None:
+            raise ValueError("Lichess params take an index or a book, not both")
+
+
 @dataclass
 class OptacParams:
     start_fen: str
     engine: EngineParams
     search: SearchParams
+    lichess: LichessParams = field(default_factory=LichessParams)
 
     @classmethod
     def from_file(cls, path: Path):
@@ -38,4 +90,5 @@ class OptacParams:
             params["start_fen"],
             EngineParams(**params["engine"]),
             SearchParams(**params["search"]),
+            LichessParams(**params.get("lichess", {})),
         )
@@ -1,28 +1,180 @@
+import dbm
+import json
 import shelve
-from dataclasses import dataclass
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from pathlib import Path
 
-from chess import Board
+from chess import Board, Move
 
 from optac.analyse import Analysis
+from optac.encoding import (
+    decode_analysis,
+    decode_tactic,
+    decode_top_moves,
+    encode_analysis,
+    encode_tactic,
+    encode_top_moves,
+)
 from optac.lichess import MoveStats
+from optac.metrics import metrics
 from optac.tactic import Tactic
+from optac.util import fen_without_ply, moves_from_text, moves_to_text, position_key
 
+SCHEMA_VERSION = 3
 
-def fen_without_ply(board: Board) -> str:
-    fen = board.fen()
-    parts = fen.split(" ")
-    assert len(parts) == 6
-    return " ".join(parts[:4])
+# Positions are keyed by their Zobrist hash, the FEN is kept to detect
+# collisions. Keys are rowids, so lookups are a single b-tree search.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    key INTEGER PRIMARY KEY,
+    fen TEXT NOT NULL,
+    tactic INTEGER REFERENCES tactics (key),
+    tactic_ply INTEGER NOT NULL DEFAULT 0,
+    expansion TEXT
+);
+
+CREATE TABLE IF NOT EXISTS top_moves (
+    key INTEGER PRIMARY KEY REFERENCES positions (key),
+    data BLOB NOT NULL,
+    source TEXT
+);
+
+CREATE TABLE IF NOT EXISTS analyses (
+    key INTEGER PRIMARY KEY REFERENCES positions (key),
+    engine TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tactics (
+    key INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    key INTEGER NOT NULL,
+    engine TEXT NOT NULL,
+    options TEXT NOT NULL,
+    multipv INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (key, engine, options, multipv)
+);
+
+CREATE TABLE IF NOT EXISTS frontier (
+    seq INTEGER PRIMARY KEY,
+    moves TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS visited (
+    key INTEGER PRIMARY KEY,
+    moves TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS search_state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+# Stores written before the binary encoding hold JSON text.
+def read_top_moves(data: bytes | str) -> list[MoveStats]:
+    if isinstance(data, str):
+        return [MoveStats.from_dict(move) for move in json.loads(data)]
+    return decode_top_moves(data)
+
+
+def read_analysis(data: bytes | str) -> Analysis:
+    if isinstance(data, str):
+        return Analysis.from_dict(json.loads(data))
+    return decode_analysis(data)
+
+
+def read_tactic(data: bytes | str) -> Tactic:
+    if isinstance(data, str):
+        return Tactic.from_dict(json.loads(data))
+    return decode_tactic(data)
+
+
+def fen_key(fen: str) -> int:
+    return position_key(Board(fen))
+
+
+def fen_keys(db: sqlite3.Connection) -> dict[str, int]:
+    # two positions with one key would be merged, a collision stops the
+    # upgrade before any table is changed
+    keys: dict[str, int] = {}
+    fens: dict[int, str] = {}
+    for (fen,) in db.execute("SELECT fen FROM positions"):
+        key = fen_key(fen)
+        if key in fens:
+            raise ValueError(f"Zobrist collision, {fens[key]}, {fen}")
+        keys[fen] = key
+        fens[key] = fen
+    return keys
+
+
+def upgrade_fen_keys(db: sqlite3.Connection):
+    # stores before schema version 1 were keyed by FEN
+    keys = fen_keys(db)
+
+    def key(fen: str) -> int:
+        return keys[fen] if fen in keys else fen_key(fen)
+
+    tables = ["positions", "top_moves", "analyses", "tactics"]
+    for table in tables:
+        db.execute(f"ALTER TABLE {table} RENAME TO fen_{table}")
+    db.executescript(SCHEMA)
+
+    for fen, tactic, tactic_ply in db.execute("SELECT * FROM fen_positions"):
+        db.execute(
+            "INSERT INTO positions (key, fen, tactic, tactic_ply) VALUES (?, ?, ?, ?)",
+            (key(fen), fen, tactic and key(tactic), tactic_ply),
+        )
+    for fen, data in db.execute("SELECT * FROM fen_top_moves"):
+        db.execute("INSERT INTO top_moves (key, data) VALUES (?, ?)", (key(fen), data))
+    for fen, engine, depth, data in db.execute("SELECT * FROM fen_analyses"):
+        db.execute(
+            "INSERT INTO analyses VALUES (?, ?, ?, ?)",
+            (key(fen), engine, depth, data),
+        )
+    for fen, data in db.execute("SELECT * FROM fen_tactics"):
+        db.execute("INSERT INTO tactics VALUES (?, ?)", (key(fen), data))
+
+    for table in tables:
+        db.execute(f"DROP TABLE fen_{table}")
+
+
+def add_expansion(db: sqlite3.Connection):
+    db.execute("ALTER TABLE positions ADD COLUMN expansion TEXT")
+
+
+def add_top_moves_source(db: sqlite3.Connection):
+    # top moves stored before schema version 3 have no known source and are
+    # fetched again
+    db.execute("ALTER TABLE top_moves ADD COLUMN source TEXT")
 
 
 @dataclass
 class Position:
     fen: str
     top_moves: list[MoveStats] | None = None
+    # the provider the top moves came from, see MoveStatsProvider.source
+    top_moves_source: str | None = None
     analysis: Analysis | None = None
     tactic: Tactic | None = None
     tactic_ply: int = 0
+    # how the search expanded this position, None if it never did
+    expansion: str | None = None
+    key: int = field(default=None)  # type: ignore[assignment]
+
+    def __post_init__(self):
+        if self.key is None:
+            self.key = fen_key(self.fen)
 
     @property
     def starts_tactic(self):
@@ -38,9 +190,12 @@ class ActivePosition(Position):
         super().__init__(
             fen=position.fen,
             top_moves=position.top_moves,
+            top_moves_source=position.top_moves_source,
             analysis=position.analysis,
             tactic=position.tactic,
             tactic_ply=position.tactic_ply,
+            expansion=position.expansion,
+            key=position.key,
         )
 
         self._store = store
@@ -52,48 +207,405 @@ class ActivePosition(Position):
         position = Position(
             fen=self.fen,
             top_moves=self.top_moves,
+            top_moves_source=self.top_moves_source,
             analysis=self.analysis,
             tactic=self.tactic,
             tactic_ply=self.tactic_ply,
+            expansion=self.expansion,
+            key=self.key,
         )
         self._store.commit(position)
 
 
 class PositionStore:
-    def __init__(self, path: Path):
+    def __init__(
+        self,
+        path: Path,
+        batch_size: int = 1000,
+        batch_seconds: float = 5.0,
+        cache_size: int = 10000,
+        mmap_size: int = 256 * 1024 * 1024,
+        check_collisions: bool = False,
+    ):
         self.path = str(path)
-        self.shelf: shelve.Shelf | None = None
-        self.open_positions = set()
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.check_collisions = check_collisions
+
+        self.connection: sqlite3.Connection | None = None
+        self.open_positions: set[int] = set()
+
+        # tactics are shared by all positions of their solution
+        self.tactics: dict[int, Tactic] = {}
+
+        # write-back LRU cache, dirty positions are written on flush or eviction
+        self.cache: OrderedDict[int, Position] = OrderedDict()
+        self.dirty: set[int] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
 
     def __enter__(self):
-        self.shelf = shelve.open(self.path)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # the position index is read through a memory map instead of reads
+        self.connection.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version < SCHEMA_VERSION:
+            if self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'positions'"
+            ).fetchone():
+                if version < 1:
+                    upgrade_fen_keys(self.connection)
+                else:
+                    if version < 2:
+                        add_expansion(self.connection)
+                    add_top_moves_source(self.connection)
+            self.connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+        self.connection.executescript(SCHEMA)
+        self.last_commit = time.monotonic()
         return self
 
     def __exit__(self, *args):
-        if self.shelf is not None:
-            self.shelf.close()
-            self.shelf = None
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+            self.tactics.clear()
+            self.cache.clear()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self.connection is None:
+            raise ValueError("PositionStore not open")
+        return self.connection
+
+    # The returned position is shared with the cache and must not be modified,
+    # use load to change it.
+    def get(self, board: Board) -> Position:
+        return self.cached(board, position_key(board))
 
     def load(self, board: Board) -> ActivePosition:
-        fen = fen_without_ply(board)
+        key = position_key(board)
 
-        if self.shelf is None:
+        if self.connection is None:
             raise ValueError("PositionStore not open")
 
-        if fen in self.open_positions:
-            raise ValueError(f"Position already opened, {fen}")
+        if key in self.open_positions:
+            raise ValueError(f"Position already opened, {board.fen()}")
+
+        self.open_positions.add(key)
+        with metrics.timer("position_load_seconds"):
+            return ActivePosition(self.cached(board, key), self)
 
-        self.open_positions.add(fen)
-        if fen in self.shelf:
-            position = self.shelf[fen]
+    def commit(self, position: Position):
+        # includes the batched flushes, they show up as the slow commits
+        with metrics.timer("position_commit_seconds"):
+            self.cache_position(position)
+            self.dirty.add(position.key)
+            self.open_positions.remove(position.key)
+
+            self.uncommitted += 1
+            if (
+                self.uncommitted >= self.batch_size
+                or time.monotonic() - self.last_commit >= self.batch_seconds
+            ):
+                self.flush()
+
+    def flush(self):
+        for key in self.dirty:
+            self.write(self.cache[key])
+        self.dirty.clear()
+
+        self.db.commit()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def cached(self, board: Board, key: int) -> Position:
+        position = self.cache.get(key)
+        if position is not None:
+            self.hits += 1
+            metrics.inc("position_cache_hits_total")
+            self.cache.move_to_end(key)
         else:
-            position = Position(fen)
+            self.misses += 1
+            metrics.inc("position_cache_misses_total")
+            position = self.read(board, key)
+            self.cache_position(position)
 
-        return ActivePosition(position, self)
+        if self.check_collisions and position.fen != fen_without_ply(board):
+            raise ValueError(f"Zobrist collision, {position.fen}, {board.fen()}")
 
-    def commit(self, position: Position):
-        if self.shelf is None:
-            raise ValueError("PositionStore not open")
+        return position
+
+    def cache_position(self, position: Position):
+        self.cache[position.key] = position
+        self.cache.move_to_end(position.key)
+
+        while len(self.cache) > self.cache_size:
+            key, evicted = self.cache.popitem(last=False)
+            self.evictions += 1
+            if key in self.dirty:
+                self.write(evicted)
+                self.dirty.remove(key)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "writes": self.writes,
+            "cached": len(self.cache),
+            "dirty": len(self.dirty),
+        }
+
+    def __contains__(self, board: Board) -> bool:
+        key = position_key(board)
+        return key in self.dirty or self.stored(key)
+
+    def __len__(self) -> int:
+        (count,) = self.db.execute("SELECT COUNT(*) FROM positions").fetchone()
+        new = sum(1 for key in self.dirty if not self.stored(key))
+        return count + new
+
+    def stored(self, key: int) -> bool:
+        row = self.db.execute("SELECT 1 FROM positions WHERE key = ?", (key,))
+        return row.fetchone() is not None
+
+    def read(self, board: Board, key: int) -> Position:
+        row = self.db.execute(
+            "SELECT fen, tactic, tactic_ply, expansion FROM positions WHERE key = ?",
+            (key,),
+        ).fetchone()
+
+        if row is None:
+            return Position(fen_without_ply(board), key=key)
+
+        fen, tactic_key, tactic_ply, expansion = row
+        position = Position(fen, tactic_ply=tactic_ply, expansion=expansion, key=key)
+
+        if tactic_key is not None:
+            position.tactic = self.read_tactic(tactic_key)
+
+        row = self.db.execute(
+            "SELECT data, source FROM top_moves WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            position.top_moves = read_top_moves(row[0])
+            position.top_moves_source = row[1]
+
+        row = self.db.execute(
+            "SELECT data FROM analyses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            position.analysis = read_analysis(row[0])
+
+        return position
+
+    def read_tactic(self, key: int) -> Tactic:
+        if key not in self.tactics:
+            row = self.db.execute(
+                "SELECT data FROM tactics WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"Tactic not stored, {key}")
+            self.tactics[key] = read_tactic(row[0])
+
+        return self.tactics[key]
+
+    def write(self, position: Position):
+        self.writes += 1
+
+        tactic_key = None
+        if position.tactic is not None:
+            tactic_key = self.write_tactic(position.tactic)
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO positions (key, fen, tactic, tactic_ply, expansion) VALUES (?, ?, ?, ?, ?)",
+            (
+                position.key,
+                position.fen,
+                tactic_key,
+                position.tactic_ply,
+                position.expansion,
+            ),
+        )
+
+        if position.top_moves is not None:
+            self.db.execute(
+                "INSERT OR REPLACE INTO top_moves (key, data, source) VALUES (?, ?, ?)",
+                (
+                    position.key,
+                    encode_top_moves(position.top_moves),
+                    position.top_moves_source,
+                ),
+            )
+
+        if position.analysis is not None:
+            analysis = position.analysis
+            self.db.execute(
+                "INSERT OR REPLACE INTO analyses (key, engine, depth, data) VALUES (?, ?, ?, ?)",
+                (
+                    position.key,
+                    analysis.engine,
+                    analysis.depth,
+                    encode_analysis(analysis),
+                ),
+            )
+
+    def write_tactic(self, tactic: Tactic) -> int:
+        key = position_key(tactic.position)
+
+        # a tactic is written once, not for every position of its solution
+        if self.tactics.get(key) is not tactic:
+            self.db.execute(
+                "INSERT OR REPLACE INTO tactics (key, data) VALUES (?, ?)",
+                (key, encode_tactic(tactic)),
+            )
+            self.tactics[key] = tactic
+
+        return key
+
+    def get_analysis(
+        self,
+        board: Board,
+        engine: str,
+        options: str,
+        depth: int,
+        multipv: int,
+    ) -> Analysis | None:
+        row = self.db.execute(
+            """
+            SELECT data FROM analysis_cache
+            WHERE key = ? AND engine = ? AND options = ?
+                AND multipv >= ? AND depth >= ?
+            ORDER BY depth DESC LIMIT 1
+            """,
+            (position_key(board), engine, options, multipv, depth),
+        ).fetchone()
+        return decode_analysis(row[0]) if row is not None else None
+
+    def put_analysis(
+        self,
+        board: Board,
+        engine: str,
+        options: str,
+        multipv: int,
+        analysis: Analysis,
+    ):
+        # only the deepest analysis per engine configuration is kept
+        self.db.execute(
+            """
+            INSERT INTO analysis_cache (key, engine, options, multipv, depth, data)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (key, engine, options, multipv) DO UPDATE
+            SET depth = excluded.depth, data = excluded.data
+            WHERE excluded.depth > analysis_cache.depth
+            """,
+            (
+                position_key(board),
+                engine,
+                options,
+                multipv,
+                analysis.depth,
+                encode_analysis(analysis),
+            ),
+        )
+
+    # The search frontier and visited positions are written in the same
+    # transactions as the positions, so a checkpoint is always consistent.
+    def get_state(self, name: str) -> str | None:
+        row = self.db.execute(
+            "SELECT value FROM search_state WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def set_state(self, name: str, value: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO search_state (name, value) VALUES (?, ?)",
+            (name, value),
+        )
+
+    def reset_search(self):
+        self.db.execute("DELETE FROM frontier")
+        self.db.execute("DELETE FROM visited")
+
+    def push_frontier(self, moves: list[Move]) -> int:
+        cursor = self.db.execute(
+            "INSERT INTO frontier (moves) VALUES (?)", (moves_to_text(moves),)
+        )
+        assert cursor.lastrowid is not None
+        return cursor.lastrowid
+
+    def pop_frontier(self, seq: int):
+        self.db.execute("DELETE FROM frontier WHERE seq = ?", (seq,))
+
+    def frontier(self) -> list[tuple[int, list[Move]]]:
+        rows = self.db.execute("SELECT seq, moves FROM frontier ORDER BY seq")
+        return [(seq, moves_from_text(moves)) for seq, moves in rows]
+
+    def add_visited(self, key: int, moves: list[Move]):
+        self.db.execute(
+            "INSERT OR REPLACE INTO visited (key, moves) VALUES (?, ?)",
+            (key, moves_to_text(moves)),
+        )
+
+    def visited(self) -> list[tuple[int, list[Move]]]:
+        rows = self.db.execute("SELECT key, moves FROM visited")
+        return [(key, moves_from_text(moves)) for key, moves in rows]
+
+
+def sqlite_tables(path: Path) -> set[str]:
+    # the tables of an SQLite file, none for other files
+    try:
+        db = sqlite3.connect(f"{Path(path).absolute().as_uri()}?mode=ro", uri=True)
+        try:
+            rows = db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            return {name for (name,) in rows}
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return set()
+
+
+def is_shelve(path: Path) -> bool:
+    # Stores before SQLite were shelves. From Python 3.13 on a shelve may be
+    # an SQLite file too, with the Dict table of dbm.sqlite3 and no positions.
+    kind = dbm.whichdb(str(path))
+    if kind is None:
+        return False
+    if kind in ("", "dbm.sqlite3"):
+        tables = sqlite_tables(path)
+        return "Dict" in tables and "positions" not in tables
+    return True
+
+
+def migrate_shelve(shelf_path: Path, store: PositionStore) -> int:
+    count = 0
+    with shelve.open(str(shelf_path), flag="r") as shelf:
+        for fen in shelf:
+            old = shelf[fen]
+            store.write(
+                Position(
+                    fen=old.fen,
+                    top_moves=old.top_moves,
+                    analysis=old.analysis,
+                    tactic=old.tactic,
+                    tactic_ply=old.tactic_ply,
+                )
+            )
+            count += 1
+
+            if count % store.batch_size == 0:
+                store.flush()
 
-        self.shelf[position.fen] = position
-        self.open_positions.remove(position.fen)
+    store.flush()
+    return count
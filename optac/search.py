@@ -1,33 +1,401 @@
 import asyncio
+import json
+from dataclasses import asdict, dataclass
+from pathlib import Path
 
 from chess import Board
 from chess.engine import EventLoopPolicy
 
-from optac.analyse import Engine
+from optac.analyse import Analysis, CachedEngine, EnginePool
+from optac import trace
 from optac.explorer import LichessExplorer
+from optac.explorer_cache import ExplorerCache
+from optac.lichess import LichessAPI, MoveStats, MoveStatsProvider
+from optac.metrics import Progress, metrics
+from optac.openings import OpeningIndex, PolyglotBook
 from optac.params import OptacParams
-from optac.position_store import PositionStore
+from optac.position_store import Position, PositionStore
 from optac.tactic import Tactic
 from optac.tactic_store import TacticStore
+from optac.util import position_key
 
 
 def mark_tactic_positions(tactic: Tactic, store: PositionStore):
     board = tactic.position.copy()
+    marked = {position_key(board)}
     board.push(tactic.solution[0])
 
     for ply, move in enumerate(tactic.solution[1:], start=1):
-        with store.load(board) as position:
-            position.tactic = tactic
-            position.tactic_ply = ply
+        # a repeated position keeps the ply it was first reached with
+        key = position_key(board)
+        if key not in marked:
+            marked.add(key)
+            with store.load(board) as position:
+                position.tactic = tactic
+                position.tactic_ply = ply
         board.push(move)
 
 
+@dataclass
+class Screening:
+    depth: int
+    threshold: int
+
+    def needs_verification(self, analysis: Analysis) -> bool:
+        return analysis.is_mate or analysis.is_forced(self.threshold)
+
+
+async def analyse_position(
+    board: Board,
+    analysis: Analysis | None,
+    engine: CachedEngine,
+    deepen: bool = False,
+    screening: Screening | None = None,
+) -> tuple[Analysis | None, Tactic | None]:
+    if analysis is None or deepen:
+        if screening is not None:
+            analysis = await engine.analyse(board, depth=screening.depth)
+            if analysis is not None and screening.needs_verification(analysis):
+                analysis = await engine.analyse(board)
+        else:
+            analysis = await engine.analyse(board)
+
+    tactic = None
+    if analysis is not None:
+        tactic = await Tactic.find_in_position(
+            position=board,
+            analysis=analysis,
+            engine=engine,
+        )
+
+    return analysis, tactic
+
+
+@dataclass
+class SearchJob:
+    index: int
+    board: Board
+    # row of the job in the persisted frontier
+    seq: int = 0
+    # key of the position the job was expanded from
+    parent: int | None = None
+    position: Position | None = None
+    unchanged: bool = False
+    top_moves: list[MoveStats] | None = None
+    analysis: Analysis | None = None
+    tactic: Tactic | None = None
+
+
+# The search runs in three stages connected by bounded queues: explore
+# workers fetch top moves concurrently, one analyse worker per engine runs
+# the engine and the single commit stage stores results and expands the
+# tree in BFS order.
+#
+# With hash affinity every engine has its own queue and a position goes to
+# the engine that analysed its parent, unless that engine is further behind
+# than the others. Siblings and children then find their lines in the hash.
+#
+# Positions with new tactics are reported, all positions only when verbose.
+class SearchPipeline:
+    def __init__(
+        self,
+        start: Board,
+        explorer: LichessExplorer,
+        engines: EnginePool,
+        position_store: PositionStore,
+        tactic_store: TacticStore,
+        fetchers: int = 1,
+        queue_size: int | None = None,
+        resume: bool = True,
+        incremental: bool = False,
+        deepen: bool = False,
+        screening: Screening | None = None,
+        hash_affinity: bool = False,
+        progress: Progress | None = None,
+        verbose: bool = False,
+    ):
+        self.start = start
+        self.explorer = explorer
+        self.engines = engines
+        self.position_store = position_store
+        self.tactic_store = tactic_store
+        self.fetchers = fetchers
+        self.resume = resume
+        self.incremental = incremental
+        self.deepen = deepen
+        self.screening = screening
+        self.hash_affinity = hash_affinity
+        self.progress = progress or Progress(engines=engines.size, live=False)
+        self.verbose = verbose
+
+        if queue_size is None:
+            queue_size = 2 * engines.size
+
+        # the frontier is the BFS queue itself, bounded by the tree
+        self.frontier: asyncio.Queue[SearchJob | None] = asyncio.Queue()
+        self.analysed: asyncio.Queue[SearchJob] = asyncio.Queue(queue_size)
+
+        # without hash affinity all engines share one queue
+        self.unanalysed: list[asyncio.Queue[SearchJob | None]]
+        if hash_affinity:
+            self.unanalysed = [asyncio.Queue(queue_size) for _ in range(engines.size)]
+        else:
+            self.unanalysed = [asyncio.Queue(queue_size)] * engines.size
+        # engine each position was sent to
+        self.owners: dict[int | None, int] = {}
+
+    async def run(self):
+        async with asyncio.TaskGroup() as tasks:
+            tasks.create_task(self.explore())
+            for index in range(self.engines.size):
+                tasks.create_task(self.analyse(index))
+            tasks.create_task(self.commit())
+
+    async def explore(self):
+        async with asyncio.TaskGroup() as tasks:
+            for number in range(self.fetchers):
+                tasks.create_task(self.fetch(number))
+
+        for queue in self.unanalysed:
+            await queue.put(None)
+
+    async def fetch(self, number: int = 0):
+        trace.lane.set(f"fetch {number + 1}")
+        while (job := await self.frontier.get()) is not None:
+            self.annotate(job)
+            with trace.span("fetch"):
+                job.position = self.position_store.get(job.board)
+                job.unchanged = self.is_unchanged(job.board, job.position)
+
+                if self.explorer.needs_top_moves(job.board, job.position):
+                    job.top_moves = await self.explorer.fetch_top_moves(job.board)
+
+            await self.unanalysed[self.route(job)].put(job)
+
+    def annotate(self, job: SearchJob):
+        # the spans of a stage are labelled with the position it works on
+        if trace.active():
+            trace.annotate(
+                position=job.index,
+                fen=job.board.fen(),
+                ply=len(job.board.move_stack) - len(self.start.move_stack),
+            )
+
+    def sample(self):
+        metrics.set("search_frontier_jobs", self.frontier.qsize())
+        # without hash affinity the queue is counted once
+        unanalysed = {id(queue): queue.qsize() for queue in self.unanalysed}
+        metrics.set("search_unanalysed_jobs", sum(unanalysed.values()))
+        metrics.set("search_analysed_jobs", self.analysed.qsize())
+
+    def route(self, job: SearchJob) -> int:
+        if not self.hash_affinity:
+            return 0
+
+        backlog = [queue.qsize() for queue in self.unanalysed]
+        index = self.owners.get(job.parent, -1)
+        if index < 0 or backlog[index] > min(backlog) + 1:
+            index = backlog.index(min(backlog))
+
+        self.owners[position_key(job.board)] = index
+        return index
+
+    async def analyse(self, index: int):
+        # every worker keeps its engine for the whole search, and the whole
+        # search is one game, so the engine never clears its hash
+        game = position_key(self.start)
+        trace.lane.set(f"engine {index + 1}")
+        async with self.engines.acquire() as engine:
+            # forced lines share the cache, so no position is analysed twice
+            cached = CachedEngine(engine, self.position_store, game=game)
+
+            while (job := await self.unanalysed[index].get()) is not None:
+                assert job.position is not None
+
+                if not job.position.in_tactic and not job.unchanged:
+                    self.annotate(job)
+                    with trace.span("analyse"):
+                        job.analysis, job.tactic = await analyse_position(
+                            job.board,
+                            job.position.analysis,
+                            cached,
+                            deepen=self.deepen,
+                            screening=self.screening,
+                        )
+
+                await self.analysed.put(job)
+
+    def is_unchanged(self, board: Board, position: Position) -> bool:
+        return (
+            self.incremental
+            and position.expansion is not None
+            and position.expansion == self.explorer.expansion(board, position)
+        )
+
+    def restore_frontier(self) -> list[SearchJob]:
+        jobs = []
+        for index, (seq, moves) in enumerate(self.position_store.frontier()):
+            board = self.start.copy()
+            for move in moves:
+                board.push(move)
+            jobs.append(SearchJob(index, board, seq=seq))
+        return jobs
+
+    async def commit(self):
+        # jobs finish out of order, commit them in the order they were queued
+        finished: dict[int, SearchJob] = {}
+        queued = 0
+        committed = 0
+        trace.lane.set("commit")
+
+        jobs = self.restore_frontier() if self.resume else []
+        if jobs:
+            self.progress.print(f"Resuming search, {len(jobs)} positions queued")
+            self.explorer.restore()
+        else:
+            self.position_store.reset_search()
+            self.explorer.visit(self.start)
+            seq = self.position_store.push_frontier(self.start.move_stack)
+            jobs = [SearchJob(0, self.start, seq=seq)]
+
+        for job in jobs:
+            self.frontier.put_nowait(job)
+        queued = len(jobs)
+        metrics.inc("search_positions_queued_total", queued)
+
+        while committed < queued:
+            job = await self.analysed.get()
+            finished[job.index] = job
+
+            while committed in finished:
+                job = finished.pop(committed)
+                committed += 1
+                metrics.inc("search_positions_total")
+
+                self.annotate(job)
+                with trace.span("commit"):
+                    next_boards = self.commit_job(job)
+
+                parent = position_key(job.board)
+                for board in next_boards:
+                    if self.explorer.visit(board):
+                        seq = self.position_store.push_frontier(board.move_stack)
+                        child = SearchJob(queued, board, seq=seq, parent=parent)
+                        self.frontier.put_nowait(child)
+                        queued += 1
+                        metrics.inc("search_positions_queued_total")
+                    elif self.verbose and not job.unchanged:
+                        self.print_transposition(board)
+
+                self.position_store.pop_frontier(job.seq)
+
+        for _ in range(self.fetchers):
+            self.frontier.put_nowait(None)
+
+    def print_transposition(self, board: Board):
+        move_order = self.explorer.first_move_order(board)
+        self.progress.print(
+            self.start.variation_san(board.move_stack),
+            "(=)",
+            self.start.variation_san(move_order),
+        )
+
+    def commit_job(self, job: SearchJob) -> list[Board]:
+        # unchanged positions are only traversed to reach changed ones
+        position = self.position_store.get(job.board)
+        job.unchanged = self.is_unchanged(job.board, position)
+        if job.unchanged:
+            return self.explorer.expand(job.board, position)
+
+        report = [self.start.variation_san(job.board.move_stack)]
+        found = False
+
+        with self.position_store.load(job.board) as position:
+            if job.top_moves is not None and self.explorer.needs_top_moves(
+                job.board, position
+            ):
+                position.top_moves = job.top_moves
+                position.top_moves_source = self.explorer.lichess.source
+
+            # an earlier position may have marked this one while it was analysed
+            if position.in_tactic:
+                report.append("(*)")
+                if position.starts_tactic:
+                    report.append(str(position.tactic))
+
+            else:
+                if job.analysis is not None:
+                    position.analysis = job.analysis
+
+                tactic = job.tactic
+                if tactic and tactic.is_valid:
+                    position.tactic = tactic
+                    position.tactic_ply = 0
+                    mark_tactic_positions(tactic, self.position_store)
+
+                    report += ["(new)", str(tactic)]
+                    found = True
+                    metrics.inc("search_tactics_total")
+                    self.tactic_store.store(tactic)
+
+            next_boards = self.explorer.expand(job.board, position)
+            position.expansion = self.explorer.expansion(job.board, position)
+
+        if found or self.verbose:
+            self.progress.print(*report)
+
+        return next_boards
+
+
 async def search(
     params: OptacParams,
     position_store: PositionStore,
     tactic_store: TacticStore,
+    resume: bool = True,
+    incremental: bool = False,
+    verbose: bool = False,
+    metrics_file: Path | None = None,
+    metrics_interval: float = 15.0,
+    trace_file: Path | None = None,
 ):
     start = Board(params.start_fen)
+
+    cache = None
+    lichess: MoveStatsProvider
+    # lookups in an index or book never wait, one fetcher keeps up
+    if params.lichess.index is not None:
+        lichess = OpeningIndex(params.lichess.index)
+        if not lichess.counts(params.lichess.speeds, params.lichess.ratings):
+            lichess.close()
+            raise ValueError(
+                f"{params.lichess.index} counts {lichess.info.get('speeds')} games "
+                f"rated {lichess.info.get('ratings')}, not the speeds and ratings "
+                "of the Lichess params"
+            )
+        fetchers = 1
+    elif params.lichess.book is not None:
+        lichess = PolyglotBook(params.lichess.book, params.lichess.book_min_weight)
+        fetchers = 1
+    else:
+        if params.lichess.cache is not None:
+            ttl = params.lichess.cache_ttl_days
+            cache = ExplorerCache(
+                params.lichess.cache,
+                ttl=ttl * 24 * 3600 if ttl is not None else None,
+                max_entries=params.lichess.cache_max_entries,
+            )
+
+        lichess = LichessAPI(
+            url=params.lichess.url,
+            speeds=params.lichess.speeds,
+            ratings=params.lichess.ratings,
+            cache=cache,
+            max_requests=params.lichess.max_requests,
+            requests_per_second=params.lichess.requests_per_second,
+            retry_after=params.lichess.retry_after,
+        )
+        fetchers = lichess.max_requests
+
     explorer = LichessExplorer(
         start_fen=params.start_fen,
         store=position_store,
@@ -35,51 +403,95 @@ async def search(
         top_n=params.search.top_n,
         max_depth=params.search.max_depth,
         min_games=params.search.min_games,
+        lichess=lichess,
     )
 
-    engine = Engine(
+    engines = EnginePool(
         params.engine.exec,
         depth=params.engine.depth,
         options=params.engine.options,
+        size=params.engine.processes,
+        nodes=params.engine.nodes,
+        movetime=params.engine.movetime,
+        threads=params.engine.threads,
+        hash=params.engine.hash,
     )
 
-    with position_store:
-        async with engine:
-            for board in explorer:
-                print(start.variation_san(board.move_stack), end="\t")
+    screening = None
+    if params.engine.screen_depth is not None:
+        screening = Screening(
+            depth=params.engine.screen_depth,
+            threshold=params.engine.screen_threshold,
+        )
 
-                with position_store.load(board) as position:
-                    if position.in_tactic:
-                        print("(*)", end="\t")
-                        if position.starts_tactic:
-                            tactic = print(str(position.tactic), end="\t")
+    metrics.reset()
+    progress = Progress(
+        engines=engines.size,
+        textfile=metrics_file,
+        textfile_interval=metrics_interval,
+    )
+
+    # a saved frontier is only resumed by a search for the same tree
+    search_id = json.dumps([params.start_fen, asdict(params.search), lichess.source])
 
-                    else:
-                        if position.analysis is None:
-                            position.analysis = await engine.analyse(board)
+    with position_store, tactic_store, trace.tracing(trace_file):
+        if position_store.get_state("search") != search_id:
+            resume = False
+        position_store.set_state("search", search_id)
 
-                        if position.analysis is not None and not position.in_tactic:
-                            tactic = await Tactic.find_in_position(
-                                position=board,
-                                analysis=position.analysis,
-                                engine=engine,
-                            )
+        async with engines:
+            pipeline = SearchPipeline(
+                start=start,
+                explorer=explorer,
+                engines=engines,
+                position_store=position_store,
+                tactic_store=tactic_store,
+                fetchers=fetchers,
+                resume=resume,
+                incremental=incremental,
+                deepen=params.engine.deepen,
+                screening=screening,
+                hash_affinity=params.engine.hash_affinity,
+                progress=progress,
+                verbose=verbose,
+            )
+            updates = asyncio.create_task(progress.run(pipeline.sample))
+            try:
+                await pipeline.run()
+            finally:
+                updates.cancel()
+                pipeline.sample()
+                progress.close()
+                lichess.close()
 
-                            if tactic and (tactic.is_mate or tactic.wins_material):
-                                position.tactic = tactic
-                                position.tactic_ply = 0
-                                mark_tactic_positions(tactic, position_store)
+    print(f"Transpositions: {len(explorer.transpositions())}")
 
-                                print("(new)\t" + str(tactic), end="")
-                                tactic_store.store(tactic)
-                print()
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Explorer cache: {stats['hits']} hits, {stats['misses']} misses")
 
 
 def run_search(
     params: OptacParams,
     position_store: PositionStore,
     tactic_store: TacticStore,
+    resume: bool = True,
+    incremental: bool = False,
+    verbose: bool = False,
+    metrics_file: Path | None = None,
+    metrics_interval: float = 15.0,
+    trace_file: Path | None = None,
 ):
     asyncio.set_event_loop_policy(EventLoopPolicy())
-    search_task = search(params, position_store, tactic_store)
+    search_task = search(
+        params,
+        position_store,
+        tactic_store,
+        resume=resume,
+        incremental=incremental,
+        verbose=verbose,
+        metrics_file=metrics_file,
+        metrics_interval=metrics_interval,
+        trace_file=trace_file,
+    )
     asyncio.run(search_task)
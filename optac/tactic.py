@@ -1,10 +1,12 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 import chess
 from chess import Board, Move
 from chess.engine import PovScore
 
-from optac.analyse import Analysis, Engine
+from optac.analyse import Analyser, Analysis
+from optac import trace
+from optac.metrics import metrics
 from optac.util import score_to_dict, pov_score_from_dict
 
 PIECE_VALUES = {
@@ -17,11 +19,78 @@ PIECE_VALUES = {
 }
 
 
+# Everything derived by replaying the moves of a tactic. It is computed once
+# and stored with the tactic, material has to be recomputed (see
+# TacticStore.revalidate) when PIECE_VALUES change.
+@dataclass
+class TacticMetadata:
+    # material won by the side to move over the solution
+    material: int
+    start_fen: str
+    variation_san: str
+    solution_san: str
+    # variation followed by the solution
+    line_san: str
+
+    @classmethod
+    def from_tactic(cls, position: Board, solution: list[Move]):
+        material = 0
+        board = position.copy(stack=False)
+        for move in solution:
+            captured = board.piece_at(move.to_square)
+            if captured is not None:
+                value = PIECE_VALUES[captured.piece_type]
+                if captured.color == position.turn:
+                    material -= value
+                else:
+                    material += value
+            board.push(move)
+
+        start = position.root()
+        variation = position.move_stack
+        return cls(
+            material=material,
+            start_fen=start.fen(),
+            variation_san=start.variation_san(variation),
+            solution_san=position.variation_san(solution),
+            line_san=start.variation_san(variation + solution),
+        )
+
+    @classmethod
+    def from_dict(cls, start_fen: str, data: dict):
+        return cls(
+            material=data["material"],
+            start_fen=start_fen,
+            variation_san=data["variation_san"],
+            solution_san=data["solution_san"],
+            line_san=data["line_san"],
+        )
+
+    def as_dict(self):
+        # the start FEN is stored with the tactic itself
+        return {
+            "material": self.material,
+            "variation_san": self.variation_san,
+            "solution_san": self.solution_san,
+            "line_san": self.line_san,
+        }
+
+
 @dataclass
 class Tactic:
     position: Board
     score: PovScore
     solution: list[Move]
+    metadata: TacticMetadata | None = field(default=None, compare=False, repr=False)
+
+    def __post_init__(self):
+        if self.metadata is None:
+            self.metadata = TacticMetadata.from_tactic(self.position, self.solution)
+
+    @property
+    def meta(self) -> TacticMetadata:
+        assert self.metadata is not None
+        return self.metadata
 
     @property
     def color(self):
@@ -33,19 +102,11 @@ class Tactic:
 
     @property
     def wins_material(self):
-        balance = 0
-        board = self.position.copy()
-        for move in self.solution:
-            captured = board.piece_at(move.to_square)
-            if captured is not None:
-                value = PIECE_VALUES[captured.piece_type]
-                if captured.color == self.color:
-                    balance -= value
-                else:
-                    balance += value
-            board.push(move)
+        return self.meta.material > 0
 
-        return balance > 0
+    @property
+    def is_valid(self):
+        return self.is_mate or self.wins_material
 
     @property
     def variation(self):
@@ -53,28 +114,21 @@ class Tactic:
 
     @property
     def variation_start(self):
-        start = self.position.copy()
-        while start.move_stack:
-            start.pop()
-        return start
+        return Board(self.meta.start_fen)
 
     def variation_san(self, with_solution: bool = False):
-        board = self.variation_start
-        moves = self.position.move_stack
-
         if with_solution:
-            moves += self.solution
-
-        return board.variation_san(moves)
+            return self.meta.line_san
+        return self.meta.variation_san
 
     def solution_san(self):
-        return self.position.variation_san(self.solution)
+        return self.meta.solution_san
 
     @staticmethod
     async def calculate_forced_sequence(
         board: Board,
         analysis: Analysis | None,
-        engine: Engine,
+        engine: Analyser,
         threshold: int = 100,
     ):
         if board.is_game_over() or analysis is None:
@@ -109,8 +163,19 @@ class Tactic:
         cls,
         position: Board,
         analysis: Analysis,
-        engine: Engine,
+        engine: Analyser,
         threshold: int = 100,
+    ):
+        with metrics.timer("tactic_find_seconds"):
+            return await cls.find(position, analysis, engine, threshold)
+
+    @classmethod
+    async def find(
+        cls,
+        position: Board,
+        analysis: Analysis,
+        engine: Analyser,
+        threshold: int,
     ):
         if analysis.is_mate:
             return cls(
@@ -120,12 +185,14 @@ class Tactic:
             )
 
         elif analysis.is_forced(threshold):
-            forced_sequence, score = await cls.calculate_forced_sequence(
-                board=position,
-                analysis=analysis,
-                engine=engine,
-                threshold=threshold,
-            )
+            with trace.span("forced_sequence") as span:
+                forced_sequence, score = await cls.calculate_forced_sequence(
+                    board=position,
+                    analysis=analysis,
+                    engine=engine,
+                    threshold=threshold,
+                )
+                span["plies"] = len(forced_sequence)
 
             return cls(
                 position=position.copy(),
@@ -140,20 +207,27 @@ class Tactic:
 
     def as_dict(self):
         return {
-            "variation_start": self.variation_start.fen(),
+            "variation_start": self.meta.start_fen,
             "variation": [move.uci() for move in self.variation],
             "score": score_to_dict(self.score),
             "solution": [move.uci() for move in self.solution],
+            "metadata": self.meta.as_dict(),
         }
 
     @classmethod
-    def from_dict(cls, data: dict):
+    def from_dict(cls, data: dict, metadata: bool = True):
         position = Board(data["variation_start"])
         for uci in data["variation"]:
             position.push_uci(uci)
 
+        # tactics stored before the metadata was added compute it
+        stored = None
+        if metadata and "metadata" in data:
+            stored = TacticMetadata.from_dict(data["variation_start"], data["metadata"])
+
         return cls(
             position=position,
             score=pov_score_from_dict(data["score"], position.turn),
             solution=[Move.from_uci(uci) for uci in data["solution"]],
+            metadata=stored,
         )
@@ -1,38 +1,274 @@
 import json
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import cached_property
 from pathlib import Path
+from typing import Iterable, Iterator
 
-from chess import Board
+from chess import Board, Color, Move
+from chess.engine import Cp, Mate, PovScore
 
-from optac.tactic import Tactic
+from optac.tactic import Tactic, TacticMetadata
+from optac.util import moves_from_text, moves_to_text, position_key
+
+SCHEMA_VERSION = 2
+
+# Tactics are keyed by the Zobrist hash of their position. The columns next
+# to the JSON data are derived from it and indexed for queries.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tactics (
+    key INTEGER PRIMARY KEY,
+    start_fen TEXT NOT NULL,
+    variation TEXT NOT NULL,
+    fen TEXT NOT NULL,
+    color INTEGER NOT NULL,
+    ply INTEGER NOT NULL,
+    mate INTEGER,
+    cp INTEGER,
+    material INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS tactics_variation ON tactics (variation);
+CREATE INDEX IF NOT EXISTS tactics_color_ply ON tactics (color, ply);
+CREATE INDEX IF NOT EXISTS tactics_mate ON tactics (mate);
+CREATE INDEX IF NOT EXISTS tactics_cp ON tactics (cp);
+CREATE INDEX IF NOT EXISTS tactics_material ON tactics (material);
+"""
+
+COLUMNS = "key, start_fen, variation, fen, color, ply, mate, cp, material, data"
+INSERT = f"INSERT OR REPLACE INTO tactics ({COLUMNS}) VALUES ({', '.join('?' * 10)})"
+
+
+def add_fen(db: sqlite3.Connection):
+    # stores before schema version 2 did not keep the position
+    db.execute("ALTER TABLE tactics ADD COLUMN fen TEXT NOT NULL DEFAULT ''")
+    for key, data in db.execute("SELECT key, data FROM tactics").fetchall():
+        tactic = Tactic.from_dict(json.loads(data))
+        db.execute(
+            "UPDATE tactics SET fen = ? WHERE key = ?", (tactic.position.fen(), key)
+        )
+
+
+def tactic_row(tactic: Tactic) -> tuple:
+    # scores are stored from the point of view of the side to move, the score
+    # of a forced sequence is that of its last analysis, often the opponent's
+    score = tactic.score.pov(tactic.color)
+    return (
+        position_key(tactic.position),
+        tactic.meta.start_fen,
+        moves_to_text(tactic.variation),
+        tactic.position.fen(),
+        int(tactic.color),
+        tactic.position.ply(),
+        score.mate(),
+        score.score(),
+        tactic.meta.material,
+        json.dumps(tactic.as_dict()),
+    )
+
+
+def revalidate_row(stored: tuple) -> tuple[tuple | None, bool]:
+    # replay the moves, recompute the metadata and the indexed columns and
+    # check the tactic still wins, runs in a worker process
+    try:
+        tactic = Tactic.from_dict(json.loads(stored[-1]), metadata=False)
+    except (ValueError, AssertionError):
+        return None, False
+
+    row = tactic_row(tactic)
+    return row if row != tuple(stored) else None, tactic.is_valid
+
+
+# A stored tactic, read from the indexed columns. The data is only parsed,
+# and the moves only replayed, when the tactic itself is needed.
+@dataclass
+class TacticRecord:
+    key: int
+    start_fen: str
+    variation_uci: str
+    fen: str
+    color: Color
+    ply: int
+    mate: int | None
+    cp: int | None
+    material: int
+    data: str
+
+    @classmethod
+    def from_row(cls, row: tuple):
+        key, start_fen, variation, fen, color, *columns = row
+        return cls(key, start_fen, variation, fen, bool(color), *columns)
+
+    @classmethod
+    def from_tactic(cls, tactic: Tactic):
+        return cls.from_row(tactic_row(tactic))
+
+    @property
+    def is_mate(self):
+        return self.mate is not None
+
+    @property
+    def score(self) -> PovScore:
+        score = Mate(self.mate) if self.mate is not None else Cp(self.cp or 0)
+        return PovScore(score, self.color)
+
+    @property
+    def variation(self) -> list[Move]:
+        return moves_from_text(self.variation_uci)
+
+    @cached_property
+    def stored(self) -> dict:
+        return json.loads(self.data)
+
+    @property
+    def solution(self) -> list[Move]:
+        return [Move.from_uci(uci) for uci in self.stored["solution"]]
+
+    @cached_property
+    def meta(self) -> TacticMetadata:
+        return TacticMetadata.from_dict(self.start_fen, self.stored["metadata"])
+
+    def board(self) -> Board:
+        # the position without its move stack
+        return Board(self.fen)
+
+    @cached_property
+    def tactic(self) -> Tactic:
+        return Tactic.from_dict(self.stored)
 
 
 class TacticStore:
     def __init__(self, path: Path):
-        self.path = path
-        self.path.mkdir(exist_ok=True)
+        self.path = Path(path)
+        self.connection: sqlite3.Connection | None = None
+
+    def __enter__(self):
+        if self.path.is_dir():
+            raise ValueError(
+                f"{self.path} is a tactic directory, migrate it with migrate-puzzles"
+            )
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
 
-    @staticmethod
-    def get_filename(tactic: Tactic):
-        return "-".join(move.uci() for move in tactic.variation) + ".json"
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version < SCHEMA_VERSION:
+            if self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'tactics'"
+            ).fetchone():
+                add_fen(self.connection)
+            self.connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
 
-    def store_root_board(self, root: Board):
-        filename = self.path / "root.fen"
-        with open(filename, "w") as f:
-            f.write(root.fen())
+        self.connection.executescript(SCHEMA)
+        return self
+
+    def __exit__(self, *args):
+        if self.connection is not None:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self.connection is None:
+            raise ValueError("TacticStore not open")
+        return self.connection
 
     def store(self, tactic: Tactic):
-        filename = self.path / self.get_filename(tactic)
-        with open(filename, "w") as f:
-            json.dump(tactic.as_dict(), f)
+        self.store_many([tactic])
+
+    def store_many(self, tactics: Iterable[Tactic]) -> int:
+        with self.db:
+            cursor = self.db.executemany(
+                INSERT, (tactic_row(tactic) for tactic in tactics)
+            )
+        return cursor.rowcount
+
+    def delete(self, keys: Iterable[int]):
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM tactics WHERE key = ?", ((key,) for key in keys)
+            )
+
+    def __len__(self) -> int:
+        (count,) = self.db.execute("SELECT COUNT(*) FROM tactics").fetchone()
+        return count
+
+    def iter_tactics(
+        self,
+        color: Color | None = None,
+        min_ply: int | None = None,
+        max_ply: int | None = None,
+        mate: bool | None = None,
+        min_material: int | None = None,
+        min_score: int | None = None,
+        max_score: int | None = None,
+        prefix: list[Move] | None = None,
+        ordered: bool = False,
+    ) -> Iterator[TacticRecord]:
+        conditions = []
+        values: list = []
+
+        def where(condition: str, *args):
+            conditions.append(condition)
+            values.extend(args)
+
+        if color is not None:
+            where("color = ?", int(color))
+        if min_ply is not None:
+            where("ply >= ?", min_ply)
+        if max_ply is not None:
+            where("ply <= ?", max_ply)
+        if mate is not None:
+            where("mate IS NOT NULL" if mate else "mate IS NULL")
+        if min_material is not None:
+            where("material >= ?", min_material)
+        # score ranges are in centipawns and exclude mates
+        if min_score is not None:
+            where("cp >= ?", min_score)
+        if max_score is not None:
+            where("cp <= ?", max_score)
+        if prefix:
+            # GLOB is case sensitive and can use the variation index
+            text = moves_to_text(prefix)
+            where("(variation = ? OR variation GLOB ?)", text, text + " *")
+
+        query = f"SELECT {COLUMNS} FROM tactics"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        # black first, then by ply, read in the order of the color/ply index
+        if ordered:
+            query += " ORDER BY color, ply, key"
+
+        for row in self.db.execute(query, values):
+            yield TacticRecord.from_row(row)
+
+    def revalidate(self, processes: int | None = None) -> list[int]:
+        # rewrite the metadata and columns of all tactics, returns those no
+        # longer valid
+        rows = self.db.execute(f"SELECT {COLUMNS} FROM tactics").fetchall()
+        keys = [row[0] for row in rows]
+
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(revalidate_row, rows, chunksize=256))
+
+        with self.db:
+            self.db.executemany(INSERT, (row for row, _ in results if row is not None))
+
+        return [key for key, (_, is_valid) in zip(keys, results) if not is_valid]
+
+    def list(self, **filters) -> list[TacticRecord]:
+        return list(self.iter_tactics(**filters))
 
-    def iter_tactics(self):
-        for filename in self.path.iterdir():
-            if filename.suffix != ".json":
-                continue
 
-            with open(filename) as f:
-                tactic = Tactic.from_dict(json.load(f))
-                yield tactic
+def migrate_directory(directory: Path, store: TacticStore) -> int:
+    # stores before the database kept one JSON file per tactic
+    def read():
+        for filename in directory.iterdir():
+            if filename.suffix == ".json":
+                with open(filename) as f:
+                    yield Tactic.from_dict(json.load(f))
 
-    def list(self):
-        return list(self.iter_tactics())
+    return store.store_many(read())
@@ -0,0 +1,124 @@
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Iterator
+
+# the worker a task runs as, every worker is a track of the trace
+lane: ContextVar[str] = ContextVar("lane", default="main")
+# the position a task works on, added to all of its spans
+position: ContextVar[dict] = ContextVar("position", default={})
+
+
+def microseconds(seconds: float) -> float:
+    return round(seconds * 1e6, 1)
+
+
+# Spans in the Chrome trace-event format, as read by Perfetto and
+# chrome://tracing. Events are written as they end, so a long search
+# never holds its trace in memory.
+class Tracer:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.file.write("[")
+        self.events = 0
+        self.origin = time.perf_counter()
+        self.lanes: dict[str, int] = {}
+
+    def close(self):
+        self.file.write("\n]\n")
+        self.file.close()
+
+    def emit(self, event: dict):
+        self.file.write(",\n" if self.events else "\n")
+        self.file.write(json.dumps(event))
+        self.events += 1
+
+    def tid(self, name: str) -> int:
+        if name not in self.lanes:
+            self.lanes[name] = len(self.lanes) + 1
+            self.emit(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 1,
+                    "tid": self.lanes[name],
+                    "args": {"name": name},
+                }
+            )
+        return self.lanes[name]
+
+    def complete(self, name: str, start: float, end: float, args: dict):
+        self.emit(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": microseconds(start - self.origin),
+                "dur": microseconds(end - start),
+                "pid": 1,
+                "tid": self.tid(lane.get()),
+                "args": {**position.get(), **args},
+            }
+        )
+
+    def instant(self, name: str, args: dict):
+        self.emit(
+            {
+                "name": name,
+                "ph": "i",
+                "s": "t",
+                "ts": microseconds(time.perf_counter() - self.origin),
+                "pid": 1,
+                "tid": self.tid(lane.get()),
+                "args": {**position.get(), **args},
+            }
+        )
+
+
+# the trace of the running search, if it is traced
+tracer: Tracer | None = None
+
+
+@contextmanager
+def tracing(path: Path | None) -> Iterator[Tracer | None]:
+    global tracer
+    if path is None:
+        yield None
+        return
+
+    tracer = Tracer(path)
+    try:
+        yield tracer
+    finally:
+        tracer.close()
+        tracer = None
+
+
+def active() -> bool:
+    return tracer is not None
+
+
+def annotate(**attributes):
+    position.set(attributes)
+
+
+def record(name: str, start: float, end: float, args: dict):
+    if tracer is not None:
+        tracer.complete(name, start, end, args)
+
+
+def event(name: str, **args):
+    if tracer is not None:
+        tracer.instant(name, args)
+
+
+# The arguments are yielded, so a span can add what it found out.
+@contextmanager
+def span(name: str, **args) -> Iterator[dict]:
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        record(name, start, time.perf_counter(), args)
@@ -1,7 +1,44 @@
+from typing import Iterable
+
 import chess
+import chess.polyglot
+from chess import Board, Move
 from chess.engine import Cp, Mate, PovScore, Score
 
 
+def fen_without_ply(board: Board) -> str:
+    fen = board.fen()
+    parts = fen.split(" ")
+    assert len(parts) == 6
+    return " ".join(parts[:4])
+
+
+def position_key(board: Board) -> int:
+    # Zobrist hash as a signed 64 bit integer, to fit into an SQLite INTEGER
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+# Moves in 16 bits: from and to square and the promotion piece type, as
+# stored by the binary encoding and the opening index.
+def pack_move(move: Move) -> int:
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def unpack_move(packed: int) -> Move:
+    return Move(packed & 0x3F, packed >> 6 & 0x3F, packed >> 12 or None)
+
+
+# Move sequences as stored in SQLite text columns, UCI moves separated by
+# spaces.
+def moves_to_text(moves: Iterable[Move]) -> str:
+    return " ".join(move.uci() for move in moves)
+
+
+def moves_from_text(text: str) -> list[Move]:
+    return [Move.from_uci(uci) for uci in text.split()]
+
+
 def score_to_dict(score: Score | PovScore) -> dict[str, int | None]:
     if isinstance(score, PovScore):
         score = score.white()
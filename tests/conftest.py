@@ -0,0 +1,13 @@
+from pathlib import Path
+
+import pytest
+
+from benchmarks.suite import engine_command
+
+
+# The scripted engine of the benchmarks, instant unless a test sets
+# FAKE_ENGINE_DELAY itself.
+@pytest.fixture
+def fake_engine(tmp_path, monkeypatch) -> Path:
+    monkeypatch.setenv("FAKE_ENGINE_DELAY", "0")
+    return engine_command(tmp_path)
@@ -0,0 +1,19 @@
+from benchmarks.suite import bench_search, run_isolated
+
+
+def test_search_benchmark(tmp_path):
+    result = run_isolated(
+        bench_search,
+        directory=tmp_path,
+        width=2,
+        depth=3,
+        engines=2,
+        engine_delay=0,
+        latency=0,
+        rate_limit_every=5,
+    )
+
+    # a binary tree of three plies below the start position
+    assert result["positions"] == 1 + 2 + 4 + 8
+    assert result["rate_limited"] > 0
+    assert result["engine_searches"] >= result["positions"]
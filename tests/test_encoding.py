@@ -0,0 +1,120 @@
+import pickle
+
+import chess
+import pytest
+from chess import Board, Move
+from chess.engine import Cp, Mate, PovScore
+
+from optac.analyse import Analysis, ScoredPV
+from optac.encoding import (
+    Writer,
+    decode_analysis,
+    decode_tactic,
+    decode_top_moves,
+    encode_analysis,
+    encode_tactic,
+    encode_top_moves,
+)
+from optac.lichess import MoveStats
+from optac.tactic import Tactic, TacticMetadata
+
+
+def moves(*ucis: str) -> list[Move]:
+    return [Move.from_uci(uci) for uci in ucis]
+
+
+def test_top_moves():
+    top_moves = [
+        MoveStats(Move.from_uci("e2e4"), white=123456789, black=0, draws=42),
+        MoveStats(Move.from_uci("a7a8q"), white=1, black=2, draws=3),
+    ]
+
+    data = encode_top_moves(top_moves)
+
+    assert decode_top_moves(data) == top_moves
+    assert len(data) < len(pickle.dumps(top_moves)) / 5
+
+
+@pytest.mark.parametrize(
+    "score",
+    [
+        PovScore(Cp(35), chess.WHITE),
+        PovScore(Cp(-1200), chess.BLACK),
+        PovScore(Mate(3), chess.BLACK),
+        PovScore(Mate(-1), chess.WHITE),
+    ],
+)
+def test_analysis(score):
+    analysis = Analysis(
+        "stockfish",
+        depth=25,
+        result=[
+            ScoredPV(moves("e7e5", "g1f3"), score),
+            ScoredPV(moves("c7c5"), PovScore(Cp(0), score.turn)),
+        ],
+    )
+
+    decoded = decode_analysis(encode_analysis(analysis))
+
+    assert decoded == analysis
+    assert decoded.turn == score.turn
+
+
+def test_tactic():
+    position = Board()
+    for san in "e4 e5 Bc4 Nc6 Qh5 Nf6".split():
+        position.push_san(san)
+
+    tactic = Tactic(
+        position=position,
+        score=PovScore(Mate(1), chess.WHITE),
+        solution=moves("h5f7"),
+    )
+
+    decoded = decode_tactic(encode_tactic(tactic))
+
+    assert decoded.position.fen() == position.fen()
+    assert decoded.position.move_stack == position.move_stack
+    assert decoded.score == tactic.score
+    assert decoded.solution == tactic.solution
+    assert decoded.metadata == tactic.metadata
+
+
+def test_tactic_metadata_is_stored(monkeypatch):
+    position = Board()
+    position.push_san("e4")
+    tactic = Tactic(position, PovScore(Cp(300), chess.BLACK), moves("d7d5", "e4d5"))
+    data = encode_tactic(tactic)
+
+    # decoding does not replay the moves
+    def replay(*args):
+        raise AssertionError("metadata recomputed")
+
+    monkeypatch.setattr(TacticMetadata, "from_tactic", replay)
+    assert decode_tactic(data).metadata == tactic.metadata
+
+
+def test_tactic_version_1():
+    position = Board()
+    position.push_san("e4")
+    solution = moves("d7d5", "e4d5")
+
+    # start FEN, variation, score and solution, without metadata
+    writer = Writer()
+    writer.buffer[0] = 1
+    writer.string(position.root().fen())
+    writer.moves(position.move_stack)
+    writer.score(PovScore(Cp(-300), chess.BLACK))
+    writer.moves(solution)
+
+    decoded = decode_tactic(writer.getvalue())
+    assert decoded.solution == solution
+    assert decoded.meta.solution_san == "1...d5 2. exd5"
+
+
+def test_unknown_version():
+    data = bytearray(encode_top_moves([]))
+    data[0] = 255
+
+    with pytest.raises(ValueError):
+        decode_top_moves(bytes(data))
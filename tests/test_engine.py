@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+import pytest
+from chess import Board
+
+from optac import trace
+from optac.analyse import EnginePool
+from optac.analyse.engine import Engine, partition_resources
+from optac.metrics import metrics
+
+
+def test_partition_resources():
+    options = partition_resources({"Contempt": 0}, 3, threads=8, hash=1024)
+    assert options == {"Contempt": 0, "Threads": 2, "Hash": 341}
+
+    pool = EnginePool("stockfish", depth=20, size=4, threads=8, hash=2048)
+    assert all(engine.options["Threads"] == 2 for engine in pool.engines)
+    assert all(engine.options["Hash"] == 512 for engine in pool.engines)
+
+    with pytest.raises(ValueError):
+        partition_resources({"Threads": 4}, 2, threads=8)
+    with pytest.raises(ValueError):
+        partition_resources({}, 4, threads=2)
+
+
+def test_limits():
+    with pytest.raises(ValueError):
+        Engine("stockfish")
+
+    engine = Engine("stockfish", depth=20, nodes=10**6)
+    limit = engine.limit()
+    assert (limit.depth, limit.nodes, limit.time) == (20, 10**6, None)
+    assert engine.limit(depth=8).nodes is None
+
+
+def test_cache_key():
+    depth = Engine("stockfish", depth=20)
+    assert depth.cache_key() == (depth.options_id, 20)
+    assert depth.cache_key(8) == (depth.options_id, 8)
+
+    # node limited analyses only match the same limit
+    nodes = Engine("stockfish", nodes=10**6)
+    options, min_depth = nodes.cache_key()
+    assert options != nodes.options_id and min_depth == 0
+    assert Engine("stockfish", nodes=10**5).cache_key()[0] != options
+    assert nodes.cache_key(8) == (nodes.options_id, 8)
+
+
+async def test_pool_dispatches_concurrently(fake_engine, monkeypatch):
+    monkeypatch.setenv("FAKE_ENGINE_DELAY", "0.1")
+    boards = [Board(), Board(), Board()]
+    for board, san in zip(boards, ["e4", "d4", "c4"]):
+        board.push_san(san)
+
+    used, busy = [], []
+
+    async with EnginePool(fake_engine, depth=5, size=3) as pool:
+
+        async def analyse(board: Board):
+            async with pool.acquire() as engine:
+                used.append(engine)
+                busy.append(pool.size - pool.idle.qsize())
+                return await engine.analyse(board)
+
+        analyses = await asyncio.gather(*(analyse(board) for board in boards))
+
+        # every engine took one position, all at the same time
+        assert len({id(engine) for engine in used}) == 3
+        assert max(busy) == 3
+        assert all(analysis is not None for analysis in analyses)
+        assert pool.idle.qsize() == 3
+
+
+async def test_pool_splits_resources(fake_engine):
+    async with EnginePool(fake_engine, depth=5, size=2, threads=4, hash=64) as pool:
+        for engine in pool.engines:
+            assert engine.engine is not None
+            assert engine.engine.config["Threads"] == 2
+            assert engine.engine.config["Hash"] == 32
+
+
+async def test_pool_releases_engine_on_error(fake_engine):
+    async with EnginePool(fake_engine, depth=5, size=2) as pool:
+        with pytest.raises(RuntimeError):
+            async with pool.acquire():
+                raise RuntimeError("analysis failed")
+
+        assert pool.idle.qsize() == 2
+        assert await pool.analyse(Board()) is not None
+
+
+async def test_fen_only_for_traces(fake_engine, tmp_path, monkeypatch):
+    labels = []
+    timer = metrics.timer
+
+    def recording_timer(name: str, **args):
+        labels.append(dict(args))
+        return timer(name, **args)
+
+    monkeypatch.setattr(metrics, "timer", recording_timer)
+    async with Engine(fake_engine, depth=5) as engine:
+        await engine.analyse(Board())
+        with trace.tracing(tmp_path / "trace.json"):
+            await engine.analyse(Board())
+
+    assert labels == [{}, {"board": Board().fen()}]
+    events = json.loads((tmp_path / "trace.json").read_text())
+    (span,) = [event for event in events if event["name"] == "engine_analyse"]
+    assert span["args"] == {"board": Board().fen(), "depth": 5}
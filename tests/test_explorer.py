@@ -0,0 +1,49 @@
+import chess
+import pytest
+from chess import Board
+
+from optac.explorer import LichessExplorer
+from optac.position_store import PositionStore
+
+
+def play(*sans: str) -> Board:
+    board = Board()
+    for san in sans:
+        board.push_san(san)
+    return board
+
+
+@pytest.fixture
+def store(tmp_path):
+    with PositionStore(tmp_path / "positions.sqlite") as store:
+        yield store
+
+
+def test_transpositions(store):
+    explorer = LichessExplorer(chess.STARTING_FEN, store=store, top_n=3)
+
+    assert explorer.visit(play("e4", "e5", "Nf3", "Nc6"))
+    assert explorer.visit(play("e4", "e5", "Nf3"))
+    assert not explorer.visit(play("Nf3", "Nc6", "e4", "e5"))
+
+    transpositions = explorer.transpositions()
+    assert len(transpositions) == 1
+
+    (move_orders,) = transpositions.values()
+    assert [Board().variation_san(moves) for moves in move_orders] == [
+        "1. e4 e5 2. Nf3 Nc6",
+        "1. Nf3 Nc6 2. e4 e5",
+    ]
+
+
+def test_restore_visited(store):
+    explorer = LichessExplorer(chess.STARTING_FEN, store=store, top_n=3)
+    explorer.visit(play("e4", "e5", "Nf3", "Nc6"))
+
+    resumed = LichessExplorer(chess.STARTING_FEN, store=store, top_n=3)
+    resumed.restore()
+
+    assert not resumed.visit(play("Nf3", "Nc6", "e4", "e5"))
+    assert resumed.first_move_order(play("Nf3", "Nc6", "e4", "e5")) == list(
+        play("e4", "e5", "Nf3", "Nc6").move_stack
+    )
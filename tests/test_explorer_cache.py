@@ -0,0 +1,56 @@
+import pytest
+
+from optac.explorer_cache import ExplorerCache
+
+URL = "https://explorer.lichess.ovh/lichess"
+FEN = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+RESPONSE = {"moves": [{"uci": "e7e5", "white": 1, "draws": 2, "black": 3}]}
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return tmp_path / "explorer.sqlite3"
+
+
+def query(fen=FEN, ratings="2000"):
+    return {"fen": fen, "ratings": ratings, "topGames": 0}
+
+
+def test_normalized_fen(cache_path):
+    with ExplorerCache(cache_path) as cache:
+        assert cache.get(URL, query()) is None
+        cache.put(URL, query(), RESPONSE)
+
+        other_clock = FEN.replace("0 1", "4 7")
+        assert cache.get(URL, query(other_clock)) == RESPONSE
+        assert cache.get(URL, query(ratings="2500")) is None
+
+        assert cache.stats() == {"hits": 1, "misses": 2, "expired": 0}
+
+
+def test_shared_between_runs(cache_path):
+    with ExplorerCache(cache_path) as cache:
+        cache.put(URL, query(), RESPONSE)
+
+    with ExplorerCache(cache_path) as cache:
+        assert cache.get(URL, query()) == RESPONSE
+
+
+def test_ttl(cache_path):
+    with ExplorerCache(cache_path, ttl=-1) as cache:
+        cache.put(URL, query(), RESPONSE)
+        assert cache.get(URL, query()) is None
+        assert cache.expired == 1
+
+        cache.evict()
+        assert len(cache) == 0
+
+
+def test_max_entries(cache_path):
+    with ExplorerCache(cache_path, max_entries=2) as cache:
+        for ratings in ["1600", "1800", "2000"]:
+            cache.put(URL, query(ratings=ratings), RESPONSE)
+
+        cache.evict()
+        assert len(cache) == 2
+        assert cache.get(URL, query(ratings="1600")) is None
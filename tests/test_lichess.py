@@ -0,0 +1,71 @@
+import time
+
+import pytest
+from chess import Board
+
+from benchmarks.explorer import ExplorerStandIn
+from optac.explorer_cache import ExplorerCache
+from optac.lichess import LichessAPI, TokenBucket
+
+
+@pytest.fixture
+def server():
+    # every legal move of the start position
+    with ExplorerStandIn(width=20) as server:
+        yield server
+
+
+@pytest.fixture
+def lichess(server):
+    api = LichessAPI(url=server.url, requests_per_second=1000)
+    yield api
+    api.close()
+
+
+async def test_get_sorted_by_games(lichess):
+    moves = await lichess.get(Board())
+
+    assert len(moves) == 20
+    assert [move.games for move in moves] == sorted(
+        (move.games for move in moves), reverse=True
+    )
+
+
+async def test_retry_after_rate_limit(server, lichess):
+    server.rate_limit_first = 2
+
+    moves = await lichess.get(Board())
+
+    assert len(moves) == 20
+    assert server.requests == 3
+    assert server.rate_limited == 2
+
+
+async def test_token_bucket_rate():
+    bucket = TokenBucket(rate=50, burst=1)
+
+    start = time.monotonic()
+    for _ in range(6):
+        await bucket.acquire()
+
+    assert time.monotonic() - start >= 0.09
+
+
+async def test_cached_responses(server, tmp_path):
+    cache = ExplorerCache(tmp_path / "explorer.sqlite3")
+    api = LichessAPI(url=server.url, cache=cache, requests_per_second=1000)
+
+    first = await api.get(Board())
+    second = await api.get(Board())
+    api.close()
+
+    assert first == second
+    assert server.requests == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_source():
+    api = LichessAPI(speeds="blitz,bullet", ratings="1600,1800")
+    assert api.source == LichessAPI(speeds="bullet,blitz", ratings="1800,1600").source
+    assert api.source != LichessAPI(speeds="blitz,bullet", ratings="2500").source
+    api.close()
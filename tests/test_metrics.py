@@ -0,0 +1,71 @@
+import io
+
+from optac.metrics import Metrics, Progress
+
+
+def test_histogram_buckets():
+    metrics = Metrics()
+    for seconds in (0.001, 0.002, 0.3, 60):
+        metrics.observe("engine_analyse_seconds", seconds)
+
+    text = metrics.render()
+    assert "# TYPE optac_engine_analyse_seconds histogram" in text
+    # buckets are cumulative and include their bound
+    assert 'optac_engine_analyse_seconds_bucket{le="0.001"} 1' in text
+    assert 'optac_engine_analyse_seconds_bucket{le="0.005"} 2' in text
+    assert 'optac_engine_analyse_seconds_bucket{le="0.5"} 3' in text
+    assert 'optac_engine_analyse_seconds_bucket{le="30"} 3' in text
+    assert 'optac_engine_analyse_seconds_bucket{le="+Inf"} 4' in text
+    assert "optac_engine_analyse_seconds_count 4" in text
+    assert metrics.mean("engine_analyse_seconds") == (0.001 + 0.002 + 0.3 + 60) / 4
+
+
+def test_counters_and_gauges(tmp_path):
+    metrics = Metrics()
+    metrics.inc("lichess_requests_total")
+    metrics.inc("lichess_requests_total", 2)
+    metrics.set("search_frontier_jobs", 5)
+    metrics.set("search_frontier_jobs", 3)
+
+    with metrics.timer("position_load_seconds"):
+        pass
+
+    path = tmp_path / "optac.prom"
+    metrics.write(path)
+    text = path.read_text()
+
+    assert "# TYPE optac_lichess_requests_total counter\n" in text
+    assert "optac_lichess_requests_total 3\n" in text
+    assert "optac_search_frontier_jobs 3\n" in text
+    assert "optac_position_load_seconds_count 1\n" in text
+    assert not path.with_name("optac.prom.tmp").exists()
+
+
+def test_progress_prints_above_status():
+    metrics = Metrics()
+    metrics.inc("search_positions_total", 3)
+    metrics.inc("search_positions_queued_total", 7)
+
+    stream, output = io.StringIO(), io.StringIO()
+    progress = Progress(metrics, live=True, stream=stream, output=output)
+    progress.update()
+    progress.print("1. e4", "(new)")
+
+    assert output.getvalue() == "1. e4\t(new)\n"
+    assert "3/7 positions" in stream.getvalue()
+    # the status line is cleared before a report and drawn again after it
+    assert stream.getvalue().count("\r\033[K") == 3
+
+
+def test_progress_without_terminal(tmp_path):
+    metrics = Metrics()
+    stream, output = io.StringIO(), io.StringIO()
+    path = tmp_path / "optac.prom"
+    progress = Progress(metrics, textfile=path, stream=stream, output=output)
+
+    progress.print("1. e4")
+    progress.close()
+
+    assert stream.getvalue() == ""
+    assert output.getvalue() == "1. e4\n"
+    assert path.exists()
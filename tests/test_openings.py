@@ -0,0 +1,307 @@
+import bz2
+import struct
+import sys
+from dataclasses import replace
+
+import chess
+import chess.polyglot
+import pytest
+from chess import Board, Move
+
+from optac.explorer import LichessExplorer
+from optac.openings import GameFilter, OpeningIndex, PolyglotBook, build_index
+from optac.params import EngineParams, LichessParams, OptacParams, SearchParams
+from optac.position_store import PositionStore
+from optac.openings.build import (
+    game_speed,
+    open_pgn,
+    parse_game,
+    rating_group,
+    split_games,
+)
+from optac.search import search
+from optac.tactic_store import TacticStore
+
+PGN = """[Event "Rated Blitz game"]
+[Result "1-0"]
+[WhiteElo "1900"]
+[BlackElo "1850"]
+[TimeControl "180+2"]
+
+1. e4 { [%clk 0:03:00] } 1... e5 { [%clk 0:03:00] } 2. Nf3 Nc6 3. Bb5 a6?! 1-0
+
+[Event "Rated Bullet game"]
+[Result "0-1"]
+[WhiteElo "2000"]
+[BlackElo "2100"]
+[TimeControl "60+0"]
+
+1. e4 c5 2. Nf3 (2. c3 d5) 2... d6 $2 0-1
+
+[Event "Rated Blitz game"]
+[Result "1/2-1/2"]
+[WhiteElo "2300"]
+[BlackElo "2350"]
+[TimeControl "300+0"]
+
+1. e4 e5 2. Nf3 1/2-1/2
+
+[Event "Rated Classical game"]
+[Result "1-0"]
+[WhiteElo "1500"]
+[BlackElo "1500"]
+[TimeControl "1800+0"]
+
+1. d4 d5 1-0
+"""
+
+
+def test_game_filter():
+    assert rating_group(1450) == 1400
+    assert rating_group(2600) == 2500
+    assert rating_group(800) == 0
+    assert [game_speed(tc) for tc in ("15+0", "60+1", "300+3", "900+10", "-")] == [
+        "ultraBullet",
+        "bullet",
+        "blitz",
+        "rapid",
+        "correspondence",
+    ]
+
+    game_filter = GameFilter.from_params("blitz,bullet", "1800,2000")
+    headers = {"Result": "1-0", "WhiteElo": "1900", "BlackElo": "1850"}
+    assert game_filter.accepts({**headers, "TimeControl": "180+2"})
+    assert not game_filter.accepts({**headers, "TimeControl": "1800+0"})
+    assert not game_filter.accepts({**headers, "TimeControl": "180+2", "Result": "*"})
+    assert not game_filter.accepts({**headers, "TimeControl": "180+2", "WhiteElo": "?"})
+
+
+def test_parse_games():
+    games = list(split_games(PGN.splitlines(keepends=True)))
+    assert len(games) == 4
+
+    headers, sans = parse_game(games[1])
+    assert headers["TimeControl"] == "60+0"
+    # the variation and the NAG are not moves of the game
+    assert sans == ["e4", "c5", "Nf3", "d6"]
+
+    _, sans = parse_game(games[0])
+    assert sans == ["e4", "e5", "Nf3", "Nc6", "Bb5", "a6"]
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_build_index(tmp_path, compressed):
+    pgn = tmp_path / "games.pgn"
+    if compressed:
+        pgn = tmp_path / "games.pgn.bz2"
+        pgn.write_bytes(bz2.compress(PGN.encode()))
+    else:
+        pgn.write_text(PGN)
+
+    path = tmp_path / "openings.idx"
+    games, moves = build_index(
+        [pgn],
+        path,
+        speeds="bullet,blitz",
+        ratings="1800,2000",
+        processes=1,
+        chunk_size=2,
+    )
+    # the classical game and the game in the 2200 group are filtered
+    assert games == 2
+
+    with OpeningIndex(path) as index:
+        assert len(index) == moves
+        assert index.info["games"] == 2
+
+        (e4,) = index.moves(Board())
+        assert e4.move == Move.from_uci("e2e4")
+        assert (e4.white, e4.draws, e4.black) == (1, 0, 1)
+
+        board = Board()
+        board.push_san("e4")
+        replies = index.moves(board)
+        assert sorted(move.move.uci() for move in replies) == ["c7c5", "e7e5"]
+        assert all(move.games == 1 for move in replies)
+
+        board.push_san("d5")
+        assert index.moves(board) == []
+
+
+def test_zstd_frames(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+
+    # dumps are written as a sequence of frames
+    games = PGN.split("\n\n[Event")
+    second = "[Event" + "\n\n[Event".join(games[1:])
+    compressor = zstandard.ZstdCompressor()
+    path = tmp_path / "games.pgn.zst"
+    path.write_bytes(
+        compressor.compress((games[0] + "\n\n").encode())
+        + compressor.compress(second.encode())
+    )
+
+    with open_pgn(path) as f:
+        assert f.read() == PGN
+    with open_pgn(path) as f:
+        assert len(list(split_games(f))) == 4
+
+
+def test_zstd_missing(tmp_path, monkeypatch):
+    # an import of a module set to None fails
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+    path = tmp_path / "games.pgn.zst"
+    path.write_bytes(b"")
+    with pytest.raises(ValueError, match=r"optac\[zstd\]"):
+        open_pgn(path)
+
+
+async def test_index_filters(tmp_path, fake_engine):
+    pgn = tmp_path / "games.pgn"
+    pgn.write_text(PGN)
+    path = tmp_path / "openings.idx"
+    build_index([pgn], path, speeds="bullet,blitz", ratings="1800,2000", processes=1)
+
+    with OpeningIndex(path) as index:
+        assert index.counts("blitz,bullet", "2000,1800")
+        assert not index.counts("blitz", "1800,2000")
+        assert not index.counts("bullet,blitz", "1800,2000,2200")
+
+    async def search_with(lichess: LichessParams):
+        params = OptacParams(
+            chess.STARTING_FEN,
+            EngineParams(fake_engine, depth=5),
+            SearchParams(top_n=1, max_depth=1),
+            lichess,
+        )
+        await search(
+            params,
+            PositionStore(tmp_path / "positions.sqlite"),
+            TacticStore(tmp_path / "puzzles.sqlite"),
+        )
+
+    # a search refuses an index counting other games than its params
+    lichess = LichessParams(index=path, speeds="blitz,bullet", ratings="2000,1800")
+    with pytest.raises(ValueError, match="speeds and ratings"):
+        await search_with(replace(lichess, ratings="2000"))
+
+    await search_with(lichess)
+    with PositionStore(tmp_path / "positions.sqlite") as store:
+        assert len(store.visited()) == 2
+
+
+# with a run size of one every game is counted in its own run, so 1. e4 is
+# summed over three runs before min_games applies
+@pytest.mark.parametrize("run_size", [1, 1000])
+def test_min_games_and_max_ply(tmp_path, run_size):
+    pgn = tmp_path / "games.pgn"
+    pgn.write_text(PGN)
+
+    path = tmp_path / "openings.idx"
+    build_index(
+        [pgn],
+        path,
+        speeds="bullet,blitz,classical",
+        ratings="1400,1800,2000,2200",
+        max_ply=2,
+        min_games=2,
+        processes=1,
+        chunk_size=1,
+        run_size=run_size,
+    )
+    # the runs are removed
+    assert sorted(tmp_path.iterdir()) == [pgn, path]
+
+    with OpeningIndex(path) as index:
+        # 1. d4 d5 and 1... c5 were played once
+        assert len(index) == 2
+        (e4,) = index.moves(Board())
+        assert e4.games == 3
+
+        board = Board()
+        board.push(e4.move)
+        (e5,) = index.moves(board)
+        assert (e5.move.uci(), e5.white, e5.draws) == ("e7e5", 1, 1)
+
+
+def test_not_an_index(tmp_path):
+    path = tmp_path / "openings.idx"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        OpeningIndex(path)
+
+
+def write_book(path, entries: list[tuple[Board, str, int]]):
+    # Polyglot entries are big endian and sorted by key
+    rows = []
+    for board, uci, weight in entries:
+        move = Move.from_uci(uci)
+        raw = move.to_square | move.from_square << 6
+        if move.promotion:
+            raw |= (move.promotion - 1) << 12
+        rows.append((chess.polyglot.zobrist_hash(board), raw, weight, 0))
+    path.write_bytes(b"".join(struct.pack(">QHHI", *row) for row in sorted(rows)))
+
+
+def castling_position() -> Board:
+    return Board("r1bqkbnr/pppp1ppp/2n5/1B2p3/4P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 3 4")
+
+
+@pytest.fixture
+def book(tmp_path):
+    after_e4 = Board()
+    after_e4.push_san("e4")
+
+    path = tmp_path / "book.bin"
+    write_book(
+        path,
+        [
+            (Board(), "e2e4", 100),
+            (Board(), "d2d4", 80),
+            (Board(), "g1f3", 1),
+            # the same move twice
+            (Board(), "d2d4", 40),
+            (after_e4, "c7c5", 60),
+            # castling is stored as the king taking its rook
+            (castling_position(), "e1h1", 10),
+        ],
+    )
+    with PolyglotBook(path, minimum_weight=2) as book:
+        yield book
+
+
+async def test_polyglot_book(book):
+    moves = await book.get(Board())
+    assert [(move.move.uci(), move.white, move.black) for move in moves] == [
+        ("d2d4", 120, 0),
+        ("e2e4", 100, 0),
+    ]
+
+    board = Board()
+    board.push_san("e4")
+    (c5,) = book.moves(board)
+    # the weight is credited to the side to move
+    assert (c5.move.uci(), c5.white, c5.black, c5.games) == ("c7c5", 0, 60, 60)
+
+    (castle,) = book.moves(castling_position())
+    assert castle.move == Move.from_uci("e1g1")
+
+    board.push_san("c5")
+    assert book.moves(board) == []
+
+
+async def test_explorer_with_book(tmp_path, book):
+    with PositionStore(tmp_path / "positions.sqlite") as store:
+        explorer = LichessExplorer(
+            chess.STARTING_FEN, store=store, top_n=1, max_depth=2, lichess=book
+        )
+        moves = await explorer.fetch_top_moves(Board())
+        assert list(explorer.filter_top_moves(moves)) == [Move.from_uci("d2d4")]
+
+
+def test_empty_book(tmp_path):
+    path = tmp_path / "book.bin"
+    path.write_bytes(b"")
+    with PolyglotBook(path) as book:
+        assert len(book) == 0
+        assert book.moves(Board()) == []
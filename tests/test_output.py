@@ -0,0 +1,66 @@
+import pytest
+from chess import Board, Move
+from chess.engine import Cp, PovScore
+
+from optac.output import (
+    DiagramCache,
+    DiagramRenderer,
+    render_html,
+    render_pages,
+    write_html,
+)
+from optac.tactic import Tactic
+from optac.tactic_store import TacticRecord
+
+
+def make_record(*sans: str, solution: list[str]) -> TacticRecord:
+    board = Board()
+    for san in sans:
+        board.push_san(san)
+
+    tactic = Tactic(
+        position=board,
+        score=PovScore(Cp(300), board.turn),
+        solution=[Move.from_uci(uci) for uci in solution],
+    )
+    return TacticRecord.from_tactic(tactic)
+
+
+@pytest.fixture
+def records():
+    return [
+        make_record("e4", "e5", "Nf3", "d6", solution=["f3e5", "d6e5"]),
+        make_record("e4", "Nf6", "d3", "Ng4", solution=["d1g4", "e7e6"]),
+        make_record("d4", "e5", "dxe5", solution=["f8b4", "c2c3"]),
+    ]
+
+
+def test_diagram_cache(tmp_path, records):
+    with DiagramCache(tmp_path / "diagrams.sqlite3") as cache:
+        html = render_html(records, renderer=DiagramRenderer(cache))
+        assert cache.stats() == {"hits": 0, "misses": 3}
+        assert len(cache) == 3
+
+        assert render_html(records, renderer=DiagramRenderer(cache)) == html
+        assert cache.stats() == {"hits": 3, "misses": 3}
+
+    assert html == render_html(records)
+
+
+def test_render_pages(tmp_path, records):
+    paths = render_pages(records, tmp_path / "book.html", page_size=2)
+    assert [path.name for path in paths] == ["book.html", "book-2.html"]
+
+    first, second = (path.read_text() for path in paths)
+    assert first.count('class="puzzle"') == 2
+    assert second.count('class="puzzle"') == 1
+    assert 'href="book-2.html"' in first
+    assert 'href="book.html"' in second
+    # puzzles are numbered across pages
+    assert 'id="3"' in second
+
+
+def test_write_html(tmp_path, records):
+    path = tmp_path / "book.html"
+    write_html(iter(records), path)
+    assert path.read_text() == render_html(records)
@@ -1,3 +1,5 @@
+import shelve
+import sqlite3
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from uuid import uuid4
@@ -5,11 +7,21 @@ from uuid import uuid4
 import chess
 import pytest
 from chess import Board, Move
+from click import ClickException
+from click.testing import CliRunner
 from chess.engine import Cp, PovScore
 
 from optac.analyse import Analysis, ScoredPV
+from optac.encoding import encode_analysis, encode_top_moves
 from optac.lichess import MoveStats
-from optac.position_store import PositionStore, fen_without_ply
+from optac.__main__ import check_legacy_positions, cli
+from optac.position_store import (
+    Position,
+    PositionStore,
+    fen_without_ply,
+    is_shelve,
+    migrate_shelve,
+)
 
 
 @pytest.fixture(scope="session")
@@ -87,3 +99,226 @@ def test_transposition(position_store, top_moves):
 
     with position_store.load(board2) as position:
         assert position.top_moves == top_moves
+
+
+def test_batched_commits(tmpdir, top_moves):
+    path = tmpdir / str(uuid4())
+    board = Board()
+
+    with PositionStore(path, batch_size=2, batch_seconds=3600) as store:
+        with store.load(board) as position:
+            position.top_moves = top_moves
+
+        with PositionStore(path) as reader:
+            assert board not in reader
+
+        board.push_san("e4")
+        with store.load(board) as position:
+            position.top_moves = top_moves
+
+        with PositionStore(path) as reader:
+            assert len(reader) == 2
+
+
+def test_migrate_shelve(tmpdir, top_moves, analysis):
+    shelf_path = tmpdir / str(uuid4())
+    fen = fen_without_ply(Board())
+    with shelve.open(str(shelf_path)) as shelf:
+        shelf[fen] = Position(fen, top_moves=top_moves, analysis=analysis)
+
+    with PositionStore(tmpdir / str(uuid4())) as store:
+        assert migrate_shelve(shelf_path, store) == 1
+
+        position = store.get(Board())
+        assert position.top_moves == top_moves
+        assert position.analysis == analysis
+
+
+# positions store before schema version 1, keyed by FEN
+FEN_SCHEMA = """
+CREATE TABLE positions (
+    fen TEXT PRIMARY KEY,
+    tactic TEXT REFERENCES tactics (fen),
+    tactic_ply INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE top_moves (fen TEXT PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE analyses (
+    fen TEXT PRIMARY KEY,
+    engine TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE tactics (fen TEXT PRIMARY KEY, data BLOB NOT NULL);
+"""
+
+
+def fen_keyed_store(path: Path, top_moves, analysis):
+    boards = [Board(), Board()]
+    boards[1].push_san("e4")
+
+    db = sqlite3.connect(path)
+    db.executescript(FEN_SCHEMA)
+    for board in boards:
+        fen = fen_without_ply(board)
+        db.execute("INSERT INTO positions (fen) VALUES (?)", (fen,))
+        db.execute(
+            "INSERT INTO top_moves VALUES (?, ?)", (fen, encode_top_moves(top_moves))
+        )
+    db.execute(
+        "INSERT INTO analyses VALUES (?, ?, ?, ?)",
+        (fen_without_ply(Board()), "stockfish", 20, encode_analysis(analysis)),
+    )
+    db.commit()
+    db.close()
+    return boards
+
+
+def test_upgrade_fen_keys(tmpdir, top_moves, analysis):
+    path = tmpdir / str(uuid4())
+    boards = fen_keyed_store(path, top_moves, analysis)
+
+    with PositionStore(path, check_collisions=True) as store:
+        assert len(store) == 2
+        for board in boards:
+            position = store.get(board)
+            assert position.fen == fen_without_ply(board)
+            assert position.top_moves == top_moves
+        assert store.get(boards[0]).analysis == analysis
+        assert store.get(boards[1]).analysis is None
+
+        tables = {
+            name for (name,) in store.db.execute("SELECT name FROM sqlite_master")
+        }
+        assert not any(name.startswith("fen_") for name in tables)
+
+    # opening the upgraded store again leaves it as it is
+    with PositionStore(path) as store:
+        assert len(store) == 2
+
+
+def test_upgrade_collision(tmpdir, top_moves, analysis, monkeypatch):
+    path = tmpdir / str(uuid4())
+    fen_keyed_store(path, top_moves, analysis)
+
+    monkeypatch.setattr("optac.position_store.fen_key", lambda fen: 1)
+    with pytest.raises(ValueError, match="Zobrist collision"):
+        with PositionStore(path):
+            pass
+
+    # the store is left keyed by FEN
+    db = sqlite3.connect(path)
+    assert db.execute("SELECT COUNT(*) FROM positions").fetchone() == (2,)
+    assert db.execute("PRAGMA user_version").fetchone() == (0,)
+    db.close()
+
+
+def test_cache(tmpdir, top_moves):
+    path = tmpdir / str(uuid4())
+    board = Board()
+
+    with PositionStore(path, cache_size=1) as store:
+        with store.load(board) as position:
+            position.top_moves = top_moves
+
+        assert store.get(board).top_moves == top_moves
+        assert store.stats()["hits"] == 1
+        assert store.stats()["dirty"] == 1
+
+        # evicting a dirty position writes it
+        board.push_san("e4")
+        store.get(board)
+        assert store.stats()["evictions"] == 1
+        assert store.stats()["writes"] == 1
+
+    with PositionStore(path) as store:
+        assert store.get(Board()).top_moves == top_moves
+
+
+def test_analysis_cache(position_store, analysis):
+    board = Board()
+    shallow = Analysis(analysis.engine, depth=10, result=analysis.result)
+
+    def get(depth, options="abc", multipv=1):
+        return position_store.get_analysis(
+            board, "Stockfish 16", options, depth=depth, multipv=multipv
+        )
+
+    position_store.put_analysis(board, "Stockfish 16", "abc", 1, analysis)
+    position_store.put_analysis(board, "Stockfish 16", "abc", 1, shallow)
+
+    assert get(depth=15) == analysis
+    assert get(depth=20) == analysis
+    assert get(depth=25) is None
+    assert get(depth=15, options="other") is None
+    assert get(depth=15, multipv=2) is None
+
+
+def test_legacy_positions(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with shelve.open("positions.db") as shelf:
+        shelf["fen"] = "position"
+    Path("params.json").write_text("{}")
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ["search", "params.json", "-p", "puzzles.sqlite"])
+    assert result.exit_code != 0
+    assert "optac migrate-positions positions.db -c positions.sqlite" in result.output
+
+    # a store given explicitly, or already migrated, is used
+    with PositionStore(tmp_path / "positions.sqlite"):
+        pass
+    assert is_shelve(Path("positions.db"))
+    assert not is_shelve(tmp_path / "positions.sqlite")
+    check_legacy_positions(Path("positions.sqlite"))
+    with pytest.raises(ClickException):
+        check_legacy_positions(Path("positions.db"))
+
+
+def test_sqlite_shelve(tmp_path, monkeypatch):
+    # the table dbm.sqlite3 keeps a shelve in from Python 3.13 on
+    path = tmp_path / "positions.db"
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE Dict (key BLOB UNIQUE NOT NULL, value BLOB NOT NULL)")
+    db.commit()
+    db.close()
+    assert is_shelve(path)
+
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(ClickException, match="migrate-positions"):
+        check_legacy_positions(Path("positions.sqlite"))
+    with pytest.raises(ClickException, match="migrate-positions"):
+        check_legacy_positions(Path("positions.db"))
+
+    # neither is a position store nor a missing file
+    with PositionStore(tmp_path / "positions.sqlite"):
+        pass
+    assert not is_shelve(tmp_path / "positions.sqlite")
+    assert not is_shelve(tmp_path / "missing.db")
+    (tmp_path / "text.db").write_text("not a database")
+    assert not is_shelve(tmp_path / "text.db")
+
+
+def test_upgrade_top_moves_source(tmpdir, top_moves):
+    path = tmpdir / str(uuid4())
+    with PositionStore(path) as store:
+        with store.load(Board()) as position:
+            position.top_moves = top_moves
+            position.top_moves_source = "explorer"
+
+    # a store of schema version 2
+    db = sqlite3.connect(path)
+    db.execute("ALTER TABLE top_moves DROP COLUMN source")
+    db.execute("PRAGMA user_version=2")
+    db.commit()
+    db.close()
+
+    with PositionStore(path) as store:
+        position = store.get(Board())
+        assert position.top_moves == top_moves
+        assert position.top_moves_source is None
+
+        with store.load(Board()) as position:
+            position.top_moves_source = "explorer"
+
+    with PositionStore(path) as store:
+        assert store.get(Board()).top_moves_source == "explorer"
@@ -0,0 +1,342 @@
+import asyncio
+import signal
+
+import chess
+import pytest
+from chess import Board
+
+from benchmarks.explorer import ExplorerStandIn, synthetic_moves
+from optac.analyse import Engine, EnginePool
+from optac.explorer import LichessExplorer
+from optac.lichess import MoveStats
+from optac.params import EngineParams, LichessParams, OptacParams, SearchParams
+from optac.position_store import PositionStore
+from optac.search import (
+    Screening,
+    SearchJob,
+    SearchPipeline,
+    analyse_position,
+    search,
+)
+from optac.tactic_store import TacticStore
+from optac.util import position_key
+
+
+@pytest.fixture
+def store(tmp_path):
+    with PositionStore(tmp_path / "positions.sqlite") as store:
+        yield store
+
+
+def test_hash_affinity(store, tmp_path):
+    pipeline = SearchPipeline(
+        start=Board(),
+        explorer=LichessExplorer(chess.STARTING_FEN, store=store, top_n=3),
+        engines=EnginePool("stockfish", depth=10, size=2),
+        position_store=store,
+        tactic_store=TacticStore(tmp_path / "puzzles.sqlite"),
+        hash_affinity=True,
+    )
+
+    def route(*sans: str) -> int:
+        board = Board()
+        for san in sans[:-1]:
+            board.push_san(san)
+        parent = position_key(board)
+        board.push_san(sans[-1])
+
+        job = SearchJob(0, board, parent=parent)
+        index = pipeline.route(job)
+        pipeline.unanalysed[index].put_nowait(job)
+        return index
+
+    pipeline.owners[position_key(Board())] = 1
+
+    # children follow their parent while its engine keeps up
+    assert route("e4") == 1
+    assert route("d4") == 1
+    assert route("c4") == 0
+    assert route("e4", "e5") == 1
+    assert route("c4", "e5") == 0
+
+
+# The synthetic explorer tree of the benchmarks, without HTTP. Lookups take
+# longer for some positions, so fetches finish out of order.
+class TreeProvider:
+    def __init__(
+        self,
+        width: int = 2,
+        latency: float = 0.0,
+        fail_at: int = -1,
+        source: str = "tree",
+    ):
+        self.width = width
+        self.latency = latency
+        self.fail_at = fail_at
+        self.lookups = 0
+        self.source = source
+
+    async def get(self, board: Board) -> list[MoveStats]:
+        self.lookups += 1
+        if self.lookups == self.fail_at:
+            raise RuntimeError("explorer failed")
+
+        moves = synthetic_moves(board, self.width)
+        await asyncio.sleep(self.latency * (position_key(board) % 3))
+        return [MoveStats.from_lichess(move) for move in moves]
+
+    def close(self):
+        pass
+
+
+class RecordingPipeline(SearchPipeline):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.committed: list[SearchJob] = []
+
+    def commit_job(self, job: SearchJob) -> list[Board]:
+        self.committed.append(job)
+        return super().commit_job(job)
+
+
+def make_pipeline(store, tactic_store, engines, provider, max_depth=3, **kwargs):
+    explorer = LichessExplorer(
+        chess.STARTING_FEN,
+        store=store,
+        top_n=2,
+        max_depth=max_depth,
+        lichess=provider,
+    )
+    return RecordingPipeline(
+        start=Board(),
+        explorer=explorer,
+        engines=engines,
+        position_store=store,
+        tactic_store=tactic_store,
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def tactic_store(tmp_path):
+    with TacticStore(tmp_path / "puzzles.sqlite") as tactic_store:
+        yield tactic_store
+
+
+async def test_commit_in_bfs_order(store, tactic_store, fake_engine):
+    provider = TreeProvider(latency=0.01)
+    async with EnginePool(fake_engine, depth=5, size=2) as engines:
+        pipeline = make_pipeline(store, tactic_store, engines, provider, fetchers=3)
+        await pipeline.run()
+
+    # a binary tree of three plies below the start position
+    committed = pipeline.committed
+    assert len(committed) == 1 + 2 + 4 + 8
+    assert [job.index for job in committed] == list(range(len(committed)))
+    plies = [len(job.board.move_stack) for job in committed]
+    assert plies == sorted(plies)
+
+
+async def test_backpressure(store, tactic_store, fake_engine, monkeypatch):
+    # the engine is the bottleneck, fetches must not run ahead of it
+    monkeypatch.setenv("FAKE_ENGINE_DELAY", "0.02")
+    provider = TreeProvider()
+    queue_size, fetchers = 1, 2
+
+    async with EnginePool(fake_engine, depth=5, size=1) as engines:
+        pipeline = make_pipeline(
+            store,
+            tactic_store,
+            engines,
+            provider,
+            fetchers=fetchers,
+            queue_size=queue_size,
+        )
+        in_flight = []
+
+        async def monitor():
+            while True:
+                assert pipeline.unanalysed[0].qsize() <= queue_size
+                assert pipeline.analysed.qsize() <= queue_size
+                in_flight.append(provider.lookups - len(pipeline.committed))
+                await asyncio.sleep(0.005)
+
+        watcher = asyncio.create_task(monitor())
+        await pipeline.run()
+        watcher.cancel()
+
+    # jobs waiting for and in the engine, waiting for the commit and held
+    # by fetchers blocked on the full queue
+    assert max(in_flight) <= queue_size + engines.size + queue_size + fetchers
+    assert len(pipeline.committed) == 15
+
+
+async def test_shutdown_when_a_worker_raises(store, tactic_store, fake_engine):
+    provider = TreeProvider(fail_at=4)
+    async with EnginePool(fake_engine, depth=5, size=2) as engines:
+        pipeline = make_pipeline(store, tactic_store, engines, provider, fetchers=2)
+        with pytest.raises(ExceptionGroup) as raised:
+            await asyncio.wait_for(pipeline.run(), timeout=10)
+
+        assert raised.group_contains(RuntimeError, match="explorer failed")
+        # the other stages were cancelled and gave their engines back
+        assert engines.idle.qsize() == engines.size
+        others = asyncio.all_tasks() - {asyncio.current_task()}
+        assert not others
+
+
+def replay(moves) -> Board:
+    board = Board()
+    for move in moves:
+        board.push(move)
+    return board
+
+
+async def test_interrupted_search_resumes(store, tactic_store, fake_engine):
+    # SIGINT reaches the engines with the search, both stop mid-tree
+    engines = EnginePool(fake_engine, depth=5, size=2)
+    await engines.spawn()
+    pipeline = make_pipeline(store, tactic_store, engines, TreeProvider(), fetchers=2)
+    task = asyncio.create_task(pipeline.run())
+    while len(pipeline.committed) < 5:
+        await asyncio.sleep(0.001)
+
+    for engine in engines.engines:
+        engine.transport.send_signal(signal.SIGINT)
+    task.cancel()
+    with pytest.raises((asyncio.CancelledError, ExceptionGroup)):
+        await task
+    await asyncio.wait_for(engines.close(), timeout=5)
+
+    interrupted = len(pipeline.committed)
+    assert interrupted < 15
+    assert store.frontier()
+
+    async with EnginePool(fake_engine, depth=5, size=2) as engines:
+        pipeline = make_pipeline(store, tactic_store, engines, TreeProvider())
+        await pipeline.run()
+
+    # the frontier picked up where the first run stopped
+    assert interrupted + len(pipeline.committed) >= 15
+    assert not store.frontier()
+    visited = store.visited()
+    assert len(visited) == 15
+    for _, moves in visited:
+        assert store.get(replay(moves)).analysis is not None
+
+
+async def test_incremental_search(store, tactic_store, fake_engine):
+    async with EnginePool(fake_engine, depth=5, size=1) as engines:
+        pipeline = make_pipeline(store, tactic_store, engines, TreeProvider(), 2)
+        await pipeline.run()
+
+        provider = TreeProvider()
+        pipeline = make_pipeline(
+            store, tactic_store, engines, provider, 3, incremental=True
+        )
+        await pipeline.run()
+
+    # the former leaves are expanded now, only they and their children changed
+    changed = {
+        len(job.board.move_stack) for job in pipeline.committed if not job.unchanged
+    }
+    unchanged = {
+        len(job.board.move_stack) for job in pipeline.committed if job.unchanged
+    }
+    assert (unchanged, changed) == ({0, 1}, {2, 3})
+    assert provider.lookups == 4
+    # unchanged positions skip the engines
+    for job in pipeline.committed:
+        assert (job.analysis is None) == job.unchanged
+
+
+async def test_resume_same_search(tmp_path, fake_engine):
+    stale = Board()
+    for san in ("e4", "e5"):
+        stale.push_san(san)
+
+    async def run(top_n: int) -> bool:
+        # whether the saved frontier was resumed
+        params = OptacParams(
+            chess.STARTING_FEN,
+            EngineParams(fake_engine, depth=5),
+            SearchParams(top_n=top_n, max_depth=1),
+            LichessParams(url=explorer.url, cache=None, requests_per_second=1000),
+        )
+        with PositionStore(tmp_path / "positions.sqlite") as store:
+            store.push_frontier(stale.move_stack)
+        await search(
+            params,
+            PositionStore(tmp_path / "positions.sqlite"),
+            TacticStore(tmp_path / "puzzles.sqlite"),
+        )
+        with PositionStore(tmp_path / "positions.sqlite") as store:
+            assert not store.frontier()
+            return store.get(stale).analysis is not None
+
+    with ExplorerStandIn(width=2, depth=1) as explorer:
+        # no saved search to resume
+        assert not await run(top_n=2)
+        # a search for another tree starts over
+        assert not await run(top_n=1)
+        assert await run(top_n=1)
+
+
+class DepthRecorder:
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.depths: list[int | None] = []
+
+    async def analyse(self, board: Board, depth: int | None = None):
+        self.depths.append(depth)
+        return await self.engine.analyse(board, depth)
+
+
+@pytest.mark.parametrize(
+    "fen, verified",
+    [
+        # the fake engine scores quiet moves within 20 centipawns
+        (chess.STARTING_FEN, False),
+        # Nxh4 wins the queen
+        ("rnb1kbnr/pppp1ppp/8/4p3/4P2q/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3", True),
+    ],
+)
+async def test_screening(fake_engine, fen, verified):
+    async with Engine(fake_engine, depth=10) as engine:
+        recorder = DepthRecorder(engine)
+        analysis, tactic = await analyse_position(
+            Board(fen),
+            None,
+            recorder,
+            screening=Screening(depth=3, threshold=100),
+        )
+
+    # only positions over the threshold get the full depth analysis
+    assert analysis is not None
+    assert analysis.depth == (10 if verified else 3)
+    assert (tactic is not None) == verified
+    if verified:
+        assert recorder.depths[:2] == [3, None]
+    else:
+        assert recorder.depths == [3]
+
+
+async def test_top_moves_of_another_source(store, tactic_store, fake_engine):
+    async def run(provider: TreeProvider, **kwargs):
+        async with EnginePool(fake_engine, depth=5, size=1) as engines:
+            pipeline = make_pipeline(store, tactic_store, engines, provider, **kwargs)
+            await pipeline.run()
+
+    await run(TreeProvider(source="ratings 1600,1800"))
+    # the same games are not fetched again
+    same = TreeProvider(source="ratings 1600,1800")
+    await run(same, resume=False)
+    assert same.lookups == 0
+
+    # other ratings are, by a new search and by an incremental one
+    for incremental in (False, True):
+        other = TreeProvider(source=f"ratings 2500 {incremental}")
+        await run(other, resume=False, incremental=incremental)
+        # the positions above the leaves of the tree
+        assert other.lookups == 7
+        assert store.get(Board()).top_moves_source == other.source
@@ -1,7 +1,8 @@
 import pytest
 from chess import Board, Move
 
-from optac.analyse import Engine
+from optac.analyse import CachedEngine, Engine
+from optac.position_store import PositionStore
 from optac.tactic import Tactic
 
 ITALIAN = "r2qkbnr/ppp2ppp/2np4/4p2b/2B1P3/2N2N1P/PPPP1PP1/R1BQK2R w KQkq - 1 6"
@@ -37,6 +38,12 @@ async def test_mate(engine: Engine, italian: Board):
         "variation": ["f3e5", "h5d1"],
         "score": {"mate": 2, "cp": None},
         "solution": ["c4f7", "e8e7", "c3d5"],
+        "metadata": {
+            "material": 1,
+            "variation_san": "6. Nxe5 Bxd1",
+            "solution_san": "7. Bxf7+ Ke7 8. Nd5#",
+            "line_san": "6. Nxe5 Bxd1 7. Bxf7+ Ke7 8. Nd5#",
+        },
     }
 
     tactic = Tactic.from_dict(tactic.as_dict())
@@ -51,3 +58,36 @@ async def test_mate(engine: Engine, italian: Board):
     assert tactic.is_mate
     assert tactic.variation_san
     assert tactic.solution_san
+
+
+class CountingEngine(Engine):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = 0
+
+    async def analyse(self, board: Board, depth=None, game=None):
+        self.calls += 1
+        return await super().analyse(board, depth, game)
+
+
+async def test_forced_sequence_cache(tmp_path, fake_engine, italian: Board):
+    async def forced_sequence(depth: int) -> tuple[list[Move], int]:
+        # the line and the number of engine calls it took
+        async with CountingEngine(fake_engine, depth=depth) as engine:
+            cached = CachedEngine(engine, store)
+            analysis = await cached.analyse(italian)
+            sequence, _ = await Tactic.calculate_forced_sequence(
+                italian, analysis, cached
+            )
+            return sequence, engine.calls
+
+    with PositionStore(tmp_path / "positions.sqlite") as store:
+        sequence, calls = await forced_sequence(depth=5)
+        assert calls == len(sequence) + 1
+
+        # the same line again is read from the cache
+        assert await forced_sequence(depth=5) == (sequence, 0)
+        # a shallower request is served by the deeper analyses
+        assert (await forced_sequence(depth=3))[1] == 0
+        # a deeper one is not
+        assert (await forced_sequence(depth=8))[1] > 0
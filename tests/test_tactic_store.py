@@ -0,0 +1,139 @@
+import json
+
+import chess
+import pytest
+from chess import Board, Move
+from chess.engine import Cp, Mate, PovScore
+
+from optac.tactic import Tactic
+from optac.tactic_store import TacticRecord, TacticStore, migrate_directory
+from optac.util import position_key
+
+
+def make_tactic(*sans: str, solution: list[str], score=Cp(300)) -> Tactic:
+    board = Board()
+    for san in sans:
+        board.push_san(san)
+
+    return Tactic(
+        position=board,
+        score=PovScore(score, board.turn),
+        solution=[Move.from_uci(uci) for uci in solution],
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    with TacticStore(tmp_path / "puzzles.sqlite") as store:
+        yield store
+
+
+def test_metadata(store):
+    # 3. Nxe5 wins a pawn, the knight is not taken back
+    tactic = make_tactic("e4", "e5", "Nf3", "Nc6", "Bc4", "d6", solution=["f3e5"])
+    assert tactic.wins_material
+
+    store.store(tactic)
+    (record,) = store.list()
+    assert record == TacticRecord.from_tactic(tactic)
+
+    # stored fields are read without replaying the moves
+    assert record.fen == tactic.position.fen()
+    assert record.color == chess.WHITE and record.ply == 6
+    assert record.score == tactic.score
+    assert record.solution == tactic.solution
+    assert record.meta == tactic.metadata
+    assert record.meta.variation_san == "1. e4 e5 2. Nf3 Nc6 3. Bc4 d6"
+    assert "tactic" not in record.__dict__
+
+    assert record.tactic == tactic
+    assert record.tactic.variation == tactic.variation
+
+
+def test_queries(store):
+    pawn = make_tactic("e4", "e5", "Nf3", "d6", solution=["f3e5"])
+    mate = make_tactic("f4", "e5", "g4", solution=["d8h4"], score=Mate(1))
+    knight = make_tactic(
+        "e4", "Nf6", "d3", "Nc6", "Nc3", "Ng4", solution=["d1g4"], score=Cp(500)
+    )
+    assert store.store_many([pawn, mate, knight]) == 3
+    assert len(store) == 3
+
+    def query(**filters):
+        records = store.iter_tactics(**filters)
+        return sorted(record.meta.variation_san for record in records)
+
+    assert query(color=chess.BLACK) == [mate.variation_san()]
+    assert query(mate=True) == [mate.variation_san()]
+    assert query(mate=False, min_material=3) == [knight.variation_san()]
+    assert query(min_score=400) == [knight.variation_san()]
+    assert query(max_ply=4) == sorted([pawn.variation_san(), mate.variation_san()])
+
+    ordered = [record.meta.variation_san for record in store.iter_tactics(ordered=True)]
+    assert ordered == [
+        mate.variation_san(),
+        pawn.variation_san(),
+        knight.variation_san(),
+    ]
+
+    e4 = Move.from_uci("e2e4")
+    assert query(prefix=[e4]) == sorted([pawn.variation_san(), knight.variation_san()])
+    assert query(prefix=[e4, Move.from_uci("e7e5")]) == [pawn.variation_san()]
+    assert query(prefix=[e4, Move.from_uci("e7e6")]) == []
+
+
+def test_revalidate(store):
+    winning = make_tactic("e4", "e5", "Nf3", "d6", solution=["f3e5"])
+    losing = make_tactic("e4", "e5", "Nf3", "Nc6", solution=["f3e5", "c6e5"])
+    store.store_many([winning, losing])
+
+    # stale metadata is rewritten
+    data = winning.as_dict()
+    data["metadata"]["material"] = 0
+    store.db.execute(
+        "UPDATE tactics SET data = ?, material = 0 WHERE key = ?",
+        (json.dumps(data), position_key(winning.position)),
+    )
+
+    (invalid,) = store.revalidate(processes=2)
+    store.delete([invalid])
+
+    (record,) = store.list(min_material=1)
+    assert record.tactic == winning
+    assert record.meta.material == 1
+
+
+def test_score_of_the_side_to_move(store):
+    # the forced sequence ended with black to move, losing 300 centipawns
+    tactic = make_tactic("e4", "e5", "Nf3", "d6", solution=["f3e5", "d6e5"])
+    tactic.score = PovScore(Cp(-300), chess.BLACK)
+    store.store(tactic)
+
+    (record,) = store.list()
+    assert record.color == chess.WHITE
+    assert record.cp == 300
+    assert record.score == tactic.score
+    assert store.list(min_score=300) == [record]
+
+    # rows stored with the score of the last analysis are repaired
+    store.db.execute("UPDATE tactics SET cp = -300")
+    store.revalidate(processes=1)
+    assert store.list() == [record]
+
+
+def test_migrate_directory(store, tmp_path):
+    directory = tmp_path / "puzzles"
+    directory.mkdir()
+    tactic = make_tactic("e4", "e5", "Nf3", "d6", solution=["f3e5"])
+    # files written before the metadata was added
+    data = tactic.as_dict()
+    del data["metadata"]
+    (directory / "e2e4-e7e5-g1f3-d7d6.json").write_text(json.dumps(data))
+    (directory / "root.fen").write_text(Board().fen())
+
+    assert migrate_directory(directory, store) == 1
+    assert [record.tactic for record in store.list()] == [tactic]
+
+    with pytest.raises(ValueError):
+        with TacticStore(directory):
+            pass
@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+from optac import trace
+from optac.metrics import Metrics
+
+
+async def test_trace_events(tmp_path):
+    path = tmp_path / "trace.json"
+    metrics = Metrics()
+
+    async def worker(name: str, fen: str):
+        trace.lane.set(name)
+        trace.annotate(fen=fen)
+        with trace.span("analyse") as span:
+            with metrics.timer("engine_analyse_seconds", depth=10):
+                await asyncio.sleep(0)
+            trace.event("lichess_rate_limited", retry_after=1.0)
+            span["plies"] = 3
+
+    with trace.tracing(path):
+        assert trace.active()
+        async with asyncio.TaskGroup() as tasks:
+            tasks.create_task(worker("engine 1", "a"))
+            tasks.create_task(worker("engine 2", "b"))
+    assert not trace.active()
+
+    events = json.loads(path.read_text())
+    lanes = {
+        event["tid"]: event["args"]["name"]
+        for event in events
+        if event["name"] == "thread_name"
+    }
+    assert sorted(lanes.values()) == ["engine 1", "engine 2"]
+
+    spans = [event for event in events if event["ph"] == "X"]
+    assert len(spans) == 4
+    for span in spans:
+        # every lane works on its own position
+        fen = {"engine 1": "a", "engine 2": "b"}[lanes[span["tid"]]]
+        assert span["args"]["fen"] == fen
+        assert span["dur"] >= 0
+
+    engine = [span for span in spans if span["name"] == "engine_analyse"]
+    assert [span["args"]["depth"] for span in engine] == [10, 10]
+    analyse = [span for span in spans if span["name"] == "analyse"]
+    assert [span["args"]["plies"] for span in analyse] == [3, 3]
+
+    limited = [event for event in events if event["ph"] == "i"]
+    assert [event["args"]["retry_after"] for event in limited] == [1.0, 1.0]
+
+
+def test_not_traced(tmp_path):
+    metrics = Metrics()
+    with trace.tracing(None):
+        with metrics.timer("position_load_seconds"), trace.span("commit"):
+            trace.event("lichess_rate_limited")
+
+    assert metrics.histograms["position_load_seconds"].count == 1
+    assert list(tmp_path.iterdir()) == []
@@ -1,7 +1,8 @@
 import chess
+from chess import Move
 from chess.engine import Cp, Mate, PovScore
 
-from optac.util import pov_score_from_dict, score_to_dict
+from optac.util import pack_move, pov_score_from_dict, score_to_dict, unpack_move
 
 
 def test_mate_to_from_dict():
@@ -24,3 +25,9 @@ def test_cp_to_from_dict():
     parsed = pov_score_from_dict(score_dict, chess.BLACK)
     assert parsed.relative == Cp(123)
     assert parsed.turn == chess.BLACK
+
+
+def test_pack_move():
+    for uci in ("e2e4", "e1g1", "a7a8q", "h2h1n"):
+        move = Move.from_uci(uci)
+        assert unpack_move(pack_move(move)) == move